@@ -7,57 +7,200 @@
 # spawn (worker id)
 # return (worker id)
 # steal (thief id) (victim id)
+# steal (thief id)                the steal policy picks the victim
 # sync (worker id)
 #
 #####
 
 
+from collections import Counter, defaultdict, deque
+from copy import deepcopy
+
+from frame_store import FrameStore
 from helpers import (
-    color, frame_id_assigner, InvalidActionError, ActionParseError, Action
+    color, IDAssigner, InvalidActionError, ActionParseError, InvariantError,
+    Action, ActionRegistry, ActionResult
 )
+from steal_policies import RandomPolicy
 
 
-def parse_action(s):
-    """Parse string s, return an Action object."""
-    try:
-        s_comp = s.split()
-        action_type = s_comp[0]
-        if action_type == "undo":
-            action = Action(action_type)
-        elif action_type == "help":
-            action = Action(action_type)
-        elif action_type == "call":
-            action = Action(action_type, worker_id=s_comp[1])
-        elif action_type == "spawn":
-            action = Action(action_type, worker_id=s_comp[1])
-        elif action_type == "return":
-            action = Action(action_type, worker_id=s_comp[1])
-        elif action_type == "steal":
-            action = Action(action_type, thief_id=s_comp[1], victim_id=s_comp[2])
-        elif action_type == "sync":
-            action = Action(action_type, worker_id=s_comp[1])
-        else:
-            raise ActionParseError()
-        return action
-    except Exception:
-        raise ActionParseError()
+# Minimum number of actions between two checkpoints of the RTS state. The
+# interval is also at least the size of the state (in objects copied), so that
+# checkpointing costs O(1) amortized per action. Restoring the state (undo, or
+# recovery from an invalid action) replays at most one interval of actions on
+# top of the latest checkpoint, and then checkpoints the restored state.
+CHECKPOINT_INTERVAL = 1000
+# Number of checkpoints kept besides the one of the initial state, the latest
+# ones. Undoing further back replays from the initial state.
+MAX_CHECKPOINTS = 8
+
+# Run modes of an RTS, see RTS.set_mode
+RUN_MODES = ("default", "fast", "checked")
+# Number of actions between two runs of RTS.verify in checked mode
+VERIFY_INTERVAL = 100
+
+# RTS attributes that are not part of checkpoints: the history itself, and
+# settings that restoring does not rewind
+UNSAVED_ATTRS = ("actions", "checkpoints", "checkpoint_interval",
+                 "last_render", "touched_workers", "touched_objects",
+                 "steal_policy", "mode", "verify_interval")
+
+# Action arguments that name the workers an action acts on
+WORKER_ARGS = ("worker_id", "thief_id", "victim_id")
+
+# Event counters kept by each worker. Variants may add their own, e.g. for the
+# cost of splitter accesses.
+COUNTER_NAMES = (
+    "random_steal_success", "random_steal_fail",
+    "provably_good_steal_success", "provably_good_steal_fail",
+    "unconditional_steal_success", "unconditional_steal_fail",
+    "sync_noop", "sync_suspend",
+    "spawn", "call", "return",
+    "splitter_push", "splitter_set", "splitter_pop",
+    "splitter_access", "splitter_write",
+)
+
+
+# Action types of this simulator. Variants extend a copy of it.
+ACTIONS = ActionRegistry()
+
+
+@ACTIONS.register("undo", recorded=False)
+def _undo(rts, action):
+    if len(rts.actions) > 0:
+        rts.actions.pop()
+    rts.restore()
+
+
+@ACTIONS.register("help", recorded=False)
+def _help(rts, action):
+    print(color(rts.action_registry.help_text(), "red"))
+
+
+@ACTIONS.register("call", ("worker_id",))
+def _call(rts, action):
+    worker = rts.get_worker(action.worker_id)
+    worker.call()
+    worker.counters["call"] += 1
+
+
+@ACTIONS.register("spawn", ("worker_id",))
+def _spawn(rts, action):
+    worker = rts.get_worker(action.worker_id)
+    worker.spawn()
+    worker.counters["spawn"] += 1
+
+
+@ACTIONS.register("return", ("worker_id",))
+def _return(rts, action):
+    worker = rts.get_worker(action.worker_id)
+    worker.ret()
+    worker.counters["return"] += 1
+
+
+@ACTIONS.register("steal", ("thief_id", "victim_id"), num_optional=1,
+                  usage="steal (thief id) (victim id)\nsteal (thief id)")
+def _steal(rts, action):
+    thief = rts.get_worker(action.thief_id)
+    if action.victim_id is None:
+        # Recorded with the victim, so that replaying it does not depend on
+        # the policy
+        return rts._steal_with_policy(thief)
+    victim = rts.get_worker(action.victim_id)
+    thief.steal(victim)
+
+
+@ACTIONS.register("sync", ("worker_id",))
+def _sync(rts, action):
+    worker = rts.get_worker(action.worker_id)
+    suspends = worker.deque.is_single_frame()
+    worker.sync()
+    worker.counters["sync_suspend" if suspends else "sync_noop"] += 1
+
+
+parse_action = ACTIONS.parse
 
 
 class RTS(object):
-    def __init__(self, num_workers):
-        frame_id_assigner.reset()
+    action_registry = ACTIONS
+    checkpoint_interval = CHECKPOINT_INTERVAL
+    # State as of the last print_state_changes (a StateRender), and what
+    # changed since: the ids of the workers that acted, None if the state was
+    # restored, and the objects touched. Not part of checkpoints.
+    last_render = None
+    touched_workers = None
+    touched_objects = None
+    # Picks the victims of steals without one (see steal_policies.py), a
+    # RandomPolicy if not set. Not part of checkpoints, so that restoring does
+    # not rewind it.
+    steal_policy = None
+    # See set_mode
+    mode = "default"
+    verify_interval = None
+
+    def __init__(self, num_workers, compact_frames=False):
+        self.frame_id_assigner = IDAssigner()
+        # With compact_frames, frames are kept in a FrameStore instead of as
+        # separate objects, for simulations with many live frames
+        self.frame_store = FrameStore(Frame) if compact_frames else None
         self.num_workers = num_workers
         # Initialize blank workers
         self.workers = {}
         for i in range(self.num_workers):
             worker_id = chr(65 + i)  # chr(65) = A
-            self.workers[worker_id] = Worker(worker_id)
+            self.workers[worker_id] = Worker(worker_id, self.frame_id_assigner,
+                                             self.frame_store)
         # One worker starts with initial frame
-        self.initial_frame = Frame("initial")
+        self.initial_frame = self.workers['A'].new_frame("initial")
         self.workers['A'].deque.push(Stacklet(self.initial_frame))
         self.initial_frame.worker = self.workers['A']
         # Keep track of all actions, for restoring
+        self._init_history()
+
+    def _init_history(self):
+        """Start with an empty action history and checkpoint the initial state."""
         self.actions = []
+        # List of (number of actions, saved state, size of the state)
+        self.checkpoints = []
+        self.checkpoint()
+
+    def _add_to_history(self, action):
+        """Record a successfully performed action, checkpointing periodically."""
+        self.actions.append(action)
+        if self.checkpoint_interval is not None:
+            num_actions, _, size = self.checkpoints[-1]
+            if (
+                len(self.actions) - num_actions >=
+                max(self.checkpoint_interval, size)
+            ):
+                self.checkpoint()
+        if (
+            self.verify_interval is not None and
+            len(self.actions) % self.verify_interval == 0
+        ):
+            self.verify()
+
+    def set_mode(self, mode, verify_interval=VERIFY_INTERVAL):
+        """
+        Set the run mode. In "default" mode, workers check invariants that
+        cost O(size) on every operation, and the state is checkpointed
+        periodically. "fast" mode skips those checks and periodic
+        checkpoints, for throughput runs: the state is only checkpointed when
+        it is restored, so the first restore replays from the initial state.
+        "checked" mode is like "fast" mode, but runs verify every
+        `verify_interval` actions.
+        """
+        if mode not in RUN_MODES:
+            raise ValueError("Unknown run mode {}".format(mode))
+        self.mode = mode
+        self.verify_interval = verify_interval if mode == "checked" else None
+        self.checkpoint_interval = (
+            CHECKPOINT_INTERVAL if mode == "default" else None)
+        self._apply_mode()
+
+    def _apply_mode(self):
+        for worker in self.workers.values():
+            worker.check_invariants = self.mode == "default"
 
     def get_worker(self, worker_id):
         if worker_id not in self.workers:
@@ -65,41 +208,180 @@ class RTS(object):
         return self.workers[worker_id]
 
     def do_action(self, action):
-        if action.type == "undo":
-            if len(self.actions) > 0:
-                self.actions.pop()
-            self.restore()
-        elif action.type == "help":
-            print(color(
-                "Options:\n"
-                "undo\n"
-                "call (worker id)\n"
-                "spawn (worker id)\n"
-                "return (worker id)\n"
-                "steal (thief id) (victim id)\n"
-                "sync (worker id)\n\n",
-                "red"
-            ))
-        else:
-            # Attempt to perform action
-            if action.type == "call":
-                worker = self.get_worker(action.worker_id)
-                worker.call()
-            elif action.type == "spawn":
-                worker = self.get_worker(action.worker_id)
-                worker.spawn()
-            elif action.type == "return":
-                worker = self.get_worker(action.worker_id)
-                worker.ret()
-            elif action.type == "steal":
-                thief = self.get_worker(action.thief_id)
-                victim = self.get_worker(action.victim_id)
-                thief.steal(victim)
-            elif action.type == "sync":
-                worker = self.get_worker(action.worker_id)
-                worker.sync()
-            # If action performed without error, add to history
-            self.actions.append(action)
+        spec = self.action_registry.specs.get(action.type)
+        if spec is None:
+            raise InvalidActionError("Unknown action {}.".format(action.type))
+        performed = spec.handler(self, action)
+        if performed is None:
+            performed = action
+        if self.touched_workers is not None:
+            for arg in WORKER_ARGS:
+                worker_id = getattr(performed, arg, None)
+                if worker_id is not None:
+                    self.touched_workers.add(worker_id)
+        # If action performed without error, add to history
+        if spec.recorded:
+            self._add_to_history(performed)
+
+    def run(self, actions):
+        """
+        Perform `actions`, an iterable of Action objects or strings to parse,
+        without printing anything. Blank strings are skipped. The state is
+        restored after actions that are invalid, as in the interactive
+        simulator. Return a list of an ActionResult per action.
+        """
+        results = []
+        parse = self.action_registry.parse
+        for index, action in enumerate(actions):
+            if isinstance(action, str):
+                if not action.strip():
+                    continue
+                try:
+                    action = parse(action)
+                except ActionParseError:
+                    results.append(ActionResult(
+                        index, None, "parse",
+                        "Unable to parse action: {}".format(action.strip())))
+                    continue
+            if action.type == "help":  # only prints the options
+                results.append(ActionResult(index, action))
+                continue
+            try:
+                self.do_action(action)
+            except InvalidActionError as e:
+                results.append(ActionResult(index, action, "invalid", str(e)))
+                self.restore()
+                continue
+            results.append(ActionResult(index, action))
+        return results
+
+    def get_state(self):
+        """
+        Return the state as plain data: the frames by id (see
+        Frame.get_state) and the workers by id (see Worker.get_state).
+        """
+        return {
+            "num_actions": len(self.actions),
+            "initial_frame": self.initial_frame.id,
+            "frames": {
+                frame.id: frame.get_state() for frame in self._iter_frames()
+            },
+            "workers": {
+                worker_id: worker.get_state()
+                for worker_id, worker in self.workers.items()
+            },
+        }
+
+    def _steal_with_policy(self, thief):
+        """
+        Steal from the victim the steal policy picks for `thief`. Return the
+        steal action with the victim filled in.
+        """
+        if self.steal_policy is None:
+            self.steal_policy = RandomPolicy()
+        policy = self.steal_policy
+        policy.num_attempts += 1
+        victim = policy.choose_victim(thief, self.workers)
+        try:
+            if victim is None:
+                raise InvalidActionError("No worker to steal from.")
+            thief.steal(victim)
+        except InvalidActionError:
+            policy.num_failures += 1
+            raise
+        return Action("steal", thief_id=thief.id, victim_id=victim.id)
+
+    def get_stats(self):
+        """
+        Return the event counters and maximum deque depth of each worker, and
+        their totals, as a dict, with the attempts and failures of the steal
+        policy.
+        """
+        workers = {
+            worker_id: worker.get_stats()
+            for worker_id, worker in self.workers.items()
+        }
+        total = Counter()
+        for worker_stats in workers.values():
+            total.update(worker_stats)
+        total["max_deque_depth"] = max(
+            worker_stats["max_deque_depth"] for worker_stats in workers.values()
+        )
+        policy = self.steal_policy
+        return {
+            "total": dict(total), "workers": workers,
+            "steal_policy": None if policy is None else policy.get_stats(),
+        }
+
+    def get_histograms(self):
+        """
+        Return the cost histograms of each worker, and their totals, as a
+        dict {"total": {name: {key: count}}, "workers": {worker id: ...}}.
+        """
+        workers = {}
+        total = defaultdict(Counter)
+        for worker_id, worker in self.workers.items():
+            workers[worker_id] = {
+                name: dict(histogram)
+                for name, histogram in worker.histograms.items()
+            }
+            for name, histogram in worker.histograms.items():
+                total[name].update(histogram)
+        total = {name: dict(histogram) for name, histogram in total.items()}
+        return {"total": total, "workers": workers}
+
+    def verify(self):
+        """
+        Check the structural invariants of the state: the frame tree is a tree
+        with consistent parent links, and each frame with a worker is on the
+        deque of that worker, and vice versa (see Worker.verify). Raise
+        InvariantError if one does not hold.
+        """
+        tree_ids = set()
+        for frame in self._iter_frames():
+            if frame.id in tree_ids:
+                raise InvariantError("Frame {} is in the frame tree more than "
+                                     "once.".format(frame.id))
+            tree_ids.add(frame.id)
+            for child in frame.children:
+                if child.parent != frame:
+                    raise InvariantError("Frame {} is a child of frame {}, "
+                                         "but has another parent.".format(
+                                             child.id, frame.id))
+        on_deques = {}  # frame id -> id of the worker whose deque it is on
+        for worker in self.workers.values():
+            worker.verify()
+            for stacklet in worker.deque:
+                for frame in stacklet.frames:
+                    if frame.id not in tree_ids:
+                        raise InvariantError("Frame {} on the deque of worker "
+                                             "{} is not in the frame "
+                                             "tree.".format(frame.id,
+                                                            worker.id))
+                    if frame.id in on_deques:
+                        raise InvariantError("Frame {} is on more than one "
+                                             "deque.".format(frame.id))
+                    on_deques[frame.id] = worker.id
+        for frame in self._iter_frames():
+            if frame.worker is not None and frame.id not in on_deques:
+                raise InvariantError("Frame {} has worker {}, but is on no "
+                                     "deque.".format(frame.id,
+                                                     frame.worker.id))
+
+    def check_views(self):
+        """
+        Return the views that leaked and the views that are dangling, see
+        ViewRegistry.find_leaks. The base RTS has no views.
+        """
+        return [], []
+
+    def _iter_frames(self):
+        """Generate all frames in the frame tree."""
+        to_visit = [self.initial_frame]
+        while to_visit:
+            frame = to_visit.pop()
+            yield frame
+            to_visit.extend(frame.children)
 
     def _print_full_frame_tree_helper(self, frame):
         """Returns a list of strings that represent `frame` as a tree."""
@@ -119,9 +401,13 @@ class RTS(object):
                     str_comp.append("  {}".format(line))
         return str_comp
 
+    def _print_global_state(self):
+        """Return a representation of state that is not in frames or workers."""
+        return ""
+
     def print_state(self):
         """Print a representation of the state of the runtime system."""
-        str_comp = []
+        str_comp = [self._print_global_state()]
         # Print full frame tree
         str_comp.append(color("Full frame tree:\n\n", "yellow"))
         str_comp.extend(self._print_full_frame_tree_helper(self.initial_frame))
@@ -133,27 +419,391 @@ class RTS(object):
             str_comp.append("\n")
         return "".join(str_comp)
 
+    def _render_frame(self, render, frame):
+        """
+        Render `frame` into `render`, a StateRender. Return whether its line
+        or children changed.
+        """
+        rendered = (str(frame), tuple(child.id for child in frame.children),
+                    None if frame.parent is None else frame.parent.id)
+        last = render.frames.get(frame.id)
+        render.frames[frame.id] = rendered
+        render.show(frame.id, frame.shown_objects())
+        return last is None or last[:2] != rendered[:2]
+
+    def _render_worker(self, render, worker):
+        """
+        Render `worker` into `render`, a StateRender. Return whether its deque
+        representation changed.
+        """
+        rendered = (worker.print_state(), tuple(
+            frame.id for stacklet in worker.deque for frame in stacklet.frames))
+        last = render.workers.get(worker.id)
+        render.workers[worker.id] = rendered
+        render.show(worker.id, worker.shown_objects())
+        return last is None or last[0] != rendered[0]
+
+    def _find_frame(self, frame_id, frames, found):
+        """
+        Return the frame with id `frame_id` in the rendered `frames`, or None
+        if it was removed since, walking down the frame tree from its closest
+        ancestor in `found`, a dict of frame id -> frame (or None if removed)
+        that is extended with the frames on the way.
+        """
+        path = []
+        while frame_id not in found:
+            path.append(frame_id)
+            frame_id = frames[frame_id][2]
+        frame = found[frame_id]
+        for frame_id in reversed(path):
+            if frame is not None:
+                frame = next((child for child in frame.children
+                              if child.id == frame_id), None)
+            found[frame_id] = frame
+        return frame
+
+    def _render_all(self, global_state):
+        """Return a StateRender of the whole state."""
+        render = StateRender(global_state)
+        for frame in self._iter_frames():
+            self._render_frame(render, frame)
+        self._count_frames(render, render.frames)
+        for worker in self.workers.values():
+            self._render_worker(render, worker)
+        return render
+
+    def _render_changes(self, render, touched_workers, touched_objects):
+        """
+        Update `render`, a StateRender, for the changes made by the workers
+        `touched_workers` and to the objects `touched_objects`. The frames
+        that can have changed are the ones on the deques of these workers, as
+        of the last render or now, their parents, and the frames that show
+        these objects. Return the ids of the frames whose line or children
+        changed, of the frames that were removed, and of the workers whose
+        deque representation changed.
+        """
+        touched_workers = set(touched_workers)
+        touched = set()
+        for obj in touched_objects:
+            for owner_id in render.shown_by.get(obj, ()):
+                if owner_id in self.workers:
+                    touched_workers.add(owner_id)
+                else:
+                    touched.add(owner_id)
+        found = {self.initial_frame.id: self.initial_frame}
+        changed_workers = set()
+        for worker_id in touched_workers:
+            worker = self.workers[worker_id]
+            touched.update(render.workers[worker_id][1])
+            if self._render_worker(render, worker):
+                changed_workers.add(worker_id)
+            for stacklet in worker.deque:
+                for frame in stacklet.frames:
+                    found[frame.id] = frame
+                    touched.add(frame.id)
+                    if frame.parent is not None:
+                        found[frame.parent.id] = frame.parent
+                        touched.add(frame.parent.id)
+        for frame_id in list(touched):
+            if frame_id in render.frames:
+                parent_id = render.frames[frame_id][2]
+                if parent_id is not None:
+                    touched.add(parent_id)
+        # Find all frames before rendering any, which changes `render.frames`
+        frames = [
+            (frame_id, self._find_frame(frame_id, render.frames, found))
+            for frame_id in touched
+        ]
+        changed = set()
+        removed = set()
+        for frame_id, frame in frames:
+            if frame is None:
+                del render.frames[frame_id]
+                del render.counts[frame_id]
+                render.show(frame_id, ())
+                removed.add(frame_id)
+            elif self._render_frame(render, frame):
+                changed.add(frame_id)
+        return changed, removed, changed_workers
+
+    def _print_frame_tree_changes_helper(self, frame_id, render, changed,
+                                         dirty):
+        """
+        Like _print_full_frame_tree_helper, but subtrees that are not `dirty`
+        are collapsed to their root, and `changed` frames are highlighted.
+        """
+        line, child_ids, _ = render.frames[frame_id]
+        if frame_id in changed:
+            line = color(line, "green")
+        if frame_id not in dirty:
+            num_collapsed = render.counts[frame_id] - 1
+            if num_collapsed > 0:
+                line += color(" (+{} unchanged)".format(num_collapsed), "grey")
+            return ["{}\n".format(line)]
+        str_comp = ["{}\n".format(line)]
+        for i, child_id in enumerate(child_ids):
+            child_str_comp = self._print_frame_tree_changes_helper(
+                child_id, render, changed, dirty)
+            if i < len(child_ids) - 1:
+                str_comp.append("|-{}".format(child_str_comp[0]))
+                for line in child_str_comp[1:]:
+                    str_comp.append("| {}".format(line))
+            else:
+                str_comp.append("`-{}".format(child_str_comp[0]))
+                for line in child_str_comp[1:]:
+                    str_comp.append("  {}".format(line))
+        return str_comp
+
+    def _count_frames(self, render, dirty):
+        """
+        Update the number of frames in the subtree of each of the `dirty`
+        frames of `render`, which include the ancestors of each.
+        """
+        order = []
+        to_visit = [self.initial_frame.id] if dirty else []
+        while to_visit:
+            frame_id = to_visit.pop()
+            order.append(frame_id)
+            to_visit.extend(child_id for child_id in render.frames[frame_id][1]
+                            if child_id in dirty)
+        for frame_id in reversed(order):
+            render.counts[frame_id] = 1 + sum(
+                render.counts[child_id]
+                for child_id in render.frames[frame_id][1])
+
+    def touch(self, obj):
+        """
+        Record that `obj`, which frames or workers may show (see
+        Frame.shown_objects), was changed in place, for print_state_changes.
+        """
+        if self.touched_objects is not None:
+            self.touched_objects.add(obj)
+
+    def print_state_changes(self):
+        """
+        Print the parts of the state that changed since the last call: the
+        frame tree, with unchanged subtrees collapsed and changed frames
+        highlighted, and the deques of the workers that changed. The first
+        call prints the full state. Later calls only render the frames and
+        workers that can have changed again (see _render_changes), unless
+        the state was restored in between.
+        """
+        global_state = self._print_global_state()
+        touched_workers = self.touched_workers
+        touched_objects = self.touched_objects
+        self.touched_workers = set()
+        self.touched_objects = set()
+        render = self.last_render
+        if render is None or touched_workers is None:
+            self.last_render = self._render_all(global_state)
+            if render is None:
+                return self.print_state()
+            last_render, render = render, self.last_render
+            changed = {
+                frame_id for frame_id, rendered in render.frames.items()
+                if last_render.frames.get(frame_id, (None, None))[:2] !=
+                rendered[:2]
+            }
+            removed = set(last_render.frames) - set(render.frames)
+            changed_workers = {
+                worker_id for worker_id, rendered in render.workers.items()
+                if last_render.workers[worker_id][0] != rendered[0]
+            }
+            last_global_state = last_render.global_state
+        else:
+            changed, removed, changed_workers = self._render_changes(
+                render, touched_workers, touched_objects)
+            last_global_state = render.global_state
+            render.global_state = global_state
+        str_comp = []
+        if global_state != last_global_state:
+            str_comp.append(global_state)
+        # Frames that are new, or whose line or children changed, and all
+        # their ancestors
+        dirty = set()
+        for frame_id in changed:
+            while frame_id is not None and frame_id not in dirty:
+                dirty.add(frame_id)
+                frame_id = render.frames[frame_id][2]
+        self._count_frames(render, dirty)
+        str_comp.append(color("Frame tree changes:\n\n", "yellow"))
+        if dirty:
+            str_comp.extend(self._print_frame_tree_changes_helper(
+                self.initial_frame.id, render, changed, dirty))
+        else:
+            str_comp.append("None\n")
+        if removed:
+            str_comp.append("Removed frames: {}\n".format(
+                ", ".join(map(str, sorted(removed)))))
+        # Print changed worker deques
+        str_comp.append(color("\n\nWorker deque changes:\n\n", "yellow"))
+        unchanged = []
+        for worker_id, (rendered, _) in render.workers.items():
+            if worker_id not in changed_workers:
+                unchanged.append(worker_id)
+                continue
+            str_comp.append(color("Worker {}\n".format(worker_id), "blue"))
+            str_comp.append(rendered)
+            str_comp.append("\n")
+        if unchanged:
+            str_comp.append(color("Unchanged: Worker {}\n".format(
+                ", ".join(unchanged)), "grey"))
+        return "".join(str_comp)
+
+    def checkpoint(self):
+        """
+        Save a copy of the current state, tagged with the history length.
+        Only the initial checkpoint and the latest MAX_CHECKPOINTS are kept.
+        """
+        state = {
+            key: val for key, val in self.__dict__.items()
+            if key not in UNSAVED_ATTRS
+        }
+        memo = {}
+        saved = deepcopy(state, memo)
+        self.checkpoints.append((len(self.actions), saved, len(memo)))
+        if len(self.checkpoints) > MAX_CHECKPOINTS + 1:
+            del self.checkpoints[1]
+
     def restore(self):
         """Restore the state of the RTS after performing actions in self.actions."""
         actions_to_restore = self.actions
-        self.__init__(self.num_workers)
-        # Restore actions
-        for action in actions_to_restore:
+        # Counters record events as they happened, so they are not rewound
+        # (and replayed actions are not counted twice)
+        saved_counters = {
+            worker_id: (worker.counters, worker.histograms,
+                        worker.deque.max_len)
+            for worker_id, worker in self.workers.items()
+        }
+        # Checkpoints past the end of the history are stale (undo)
+        while self.checkpoints[-1][0] > len(actions_to_restore):
+            self.checkpoints.pop()
+        num_actions, saved, _ = self.checkpoints[-1]
+        self.__dict__.update(deepcopy(saved))
+        self.touched_workers = None
+        self.actions = actions_to_restore[:num_actions]
+        # Replay actions since the checkpoint
+        self._apply_mode()
+        for action in actions_to_restore[num_actions:]:
             self.do_action(action)
+        for worker_id, saved in saved_counters.items():
+            worker = self.workers[worker_id]
+            worker.counters, worker.histograms, worker.deque.max_len = saved
+        # So that restoring again, e.g. after the next invalid action, does
+        # not replay the same actions
+        if len(self.actions) > self.checkpoints[-1][0]:
+            self.checkpoint()
+
+
+class StateRender(object):
+    """
+    The state as of the last RTS.print_state_changes: the global state, each
+    frame as (frame line, child ids, parent id) and the number of frames in
+    its subtree, and each worker as (deque representation, ids of the frames
+    on its deque), by id. Also the objects that each frame or worker shows
+    (see Frame.shown_objects), and the ids of the frames and workers that
+    show each object.
+    """
+    def __init__(self, global_state):
+        self.global_state = global_state
+        self.frames = {}
+        self.counts = {}
+        self.workers = {}
+        self.shows = {}
+        self.shown_by = {}
+
+    def show(self, owner_id, objects):
+        """Record that the frame or worker `owner_id` shows `objects`."""
+        for obj in self.shows.pop(owner_id, ()):
+            owners = self.shown_by[obj]
+            owners.discard(owner_id)
+            if not owners:
+                del self.shown_by[obj]
+        if objects:
+            objects = set(objects)
+            self.shows[owner_id] = objects
+            for obj in objects:
+                self.shown_by.setdefault(obj, set()).add(owner_id)
 
 
 class Worker(object):
     """
     Worker object that performs actions on its deque at various control points.
     """
-    def __init__(self, id_):
+    def __init__(self, id_, frame_id_assigner, frame_store=None):
         self.deque = Deque()
         self.id = id_  # identifier for this worker in the RTS
+        # Shared by the RTS
+        self.frame_id_assigner = frame_id_assigner
+        self.frame_store = frame_store
+        self.frame_class = Frame
+        # Check invariants that cost O(size) per operation, see RTS.set_mode
+        self.check_invariants = True
+        self.counters = Counter()  # events, see COUNTER_NAMES
+        # Distributions of costs, by name, e.g. hops per splitter search
+        self.histograms = defaultdict(Counter)
+
+    def get_state(self):
+        """
+        Return the state of the worker as plain data: its deque, as a list of
+        stacklets from head to tail, each a list of frame ids from oldest to
+        youngest.
+        """
+        return {
+            "deque": [
+                [frame.id for frame in stacklet.frames]
+                for stacklet in self.deque
+            ],
+        }
+
+    def get_stats(self):
+        stats = {name: 0 for name in COUNTER_NAMES}
+        stats.update(self.counters)
+        stats["max_deque_depth"] = self.deque.max_len
+        return stats
+
+    def verify(self):
+        """
+        Check the invariants of the deque: stacklets are not empty, each
+        stacklet is a chain of calls, each stacklet was spawned from the
+        youngest frame of the one before it, and the frames are worked on by
+        this worker. Raise InvariantError if one does not hold.
+        """
+        prev_frame = None
+        for stacklet in self.deque:
+            if len(stacklet) == 0:
+                raise InvariantError("Worker {} has an empty stacklet.".format(
+                    self.id))
+            if (
+                prev_frame is not None and
+                stacklet.oldest_frame.parent != prev_frame
+            ):
+                raise InvariantError("Stacklet of frame {} of worker {} is "
+                                     "not spawned from the stacklet before "
+                                     "it.".format(stacklet.oldest_frame.id,
+                                                  self.id))
+            for parent, frame in zip(stacklet.frames, stacklet.frames[1:]):
+                if frame.type != "call" or frame.parent != parent:
+                    raise InvariantError("Frame {} is not called from frame "
+                                         "{} before it in its "
+                                         "stacklet.".format(frame.id,
+                                                            parent.id))
+            for frame in stacklet.frames:
+                if frame.worker is None or frame.worker.id != self.id:
+                    raise InvariantError("Frame {} on the deque of worker {} "
+                                         "is not worked on by it.".format(
+                                             frame.id, self.id))
+            prev_frame = stacklet.youngest_frame
+        if self.deque.max_len < len(self.deque):
+            raise InvariantError("Maximum deque depth of worker {} is "
+                                 "smaller than its deque.".format(self.id))
 
     def check_steal_valid(self, victim):
         if not self.deque.is_empty():
+            self.counters["random_steal_fail"] += 1
             raise InvalidActionError("Thief deque is not empty, cannot steal.")
         if len(victim.deque) <= 1:
+            self.counters["random_steal_fail"] += 1
             raise InvalidActionError("Victim does not have available stacklet "
                                      "to steal.")
 
@@ -166,7 +816,8 @@ class Worker(object):
             frame.worker = None
         youngest_frame = stolen_stacklet.youngest_frame
         youngest_frame.worker = self
-        stolen_stacklet.frames = [youngest_frame]
+        stolen_stacklet.truncate()
+        self.counters["random_steal_success"] += 1
         # add stolen stacklet to deque
         self.deque.push(stolen_stacklet)
 
@@ -185,6 +836,13 @@ class Worker(object):
             self.deque.pop()
             self.provably_good_steal(cur_frame)
 
+    def new_frame(self, frame_type):
+        """Return a new frame, in the frame store of the RTS if it has one."""
+        if self.frame_store is not None:
+            return self.frame_store.new_frame(frame_type,
+                                              self.frame_id_assigner.assign())
+        return self.frame_class(frame_type, self.frame_id_assigner)
+
     def check_spawn_valid(self):
         if self.deque.is_empty():  # no frame on deque, must steal first
             raise InvalidActionError("There is no frame on deque, cannot spawn.")
@@ -192,7 +850,7 @@ class Worker(object):
     def spawn(self):
         """Spawn, add a new frame on new stacklet."""
         self.check_spawn_valid()
-        new_frame = Frame("spawn")
+        new_frame = self.new_frame("spawn")
         new_frame.worker = self
         new_frame.attach(self.deque.youngest_frame)
         new_stacklet = Stacklet(new_frame)
@@ -205,7 +863,7 @@ class Worker(object):
     def call(self):
         """Call, add a new frame on current stacklet."""
         self.check_call_valid()
-        new_frame = Frame("call")
+        new_frame = self.new_frame("call")
         new_frame.worker = self
         self.deque.youngest_stacklet.push(new_frame)
 
@@ -229,6 +887,8 @@ class Worker(object):
             self.ret_from_spawn()
         else:
             raise AssertionError()
+        if self.frame_store is not None:
+            self.frame_store.release(ret_frame)
 
     def ret_from_call(self):
         ret_frame = self.deque.youngest_frame
@@ -256,6 +916,9 @@ class Worker(object):
             frame.worker is None  # and not being worked on
         ):
             self.provably_good_steal_success(frame)
+            self.counters["provably_good_steal_success"] += 1
+        else:
+            self.counters["provably_good_steal_fail"] += 1
 
     def provably_good_steal_success(self, frame):
         frame.worker = self
@@ -266,6 +929,8 @@ class Worker(object):
         assert(self.deque.is_empty() or frame.worker is not None)
         frame.worker = self
         self.deque.push(Stacklet(frame))  # steal
+        # Always succeeds, "unconditional_steal_fail" stays 0
+        self.counters["unconditional_steal_success"] += 1
 
     def print_state(self):
         str_comp = []
@@ -277,13 +942,22 @@ class Worker(object):
             str_comp.append("\n")
         return "".join(str_comp)
 
+    def shown_objects(self):
+        """
+        Return the objects that print_state shows and that other workers can
+        change in place, which they touch (see RTS.touch). None here.
+        """
+        return ()
+
 
 class Deque(object):
     """
     Stores a deque of stacklets.
     """
     def __init__(self):
-        self.deque = []  # beginning of list is head (steals), end is tail (work)
+        # Left end is head (steals), right end is tail (work)
+        self.deque = deque()
+        self.max_len = 0  # largest number of stacklets held
 
     def __len__(self):
         return len(self.deque)
@@ -305,6 +979,8 @@ class Deque(object):
 
     def push(self, stacklet):
         self.deque.append(stacklet)
+        if len(self.deque) > self.max_len:
+            self.max_len = len(self.deque)
 
     def pop(self):
         assert(len(self.deque) > 0)
@@ -312,7 +988,7 @@ class Deque(object):
 
     def pop_head(self):
         assert(len(self.deque) > 0)
-        return self.deque.pop(0)
+        return self.deque.popleft()
 
     def is_empty(self):
         return len(self.deque) == 0
@@ -358,13 +1034,17 @@ class Stacklet(object):
         assert(len(self.frames) > 1)
         self.frames.pop(index)
 
+    def truncate(self):
+        """Remove all frames except for the youngest frame, in place."""
+        del self.frames[:-1]
+
 
 class Frame(object):
     """
     Stores parent/children pointers.
     """
-    def __init__(self, frame_type):
-        self.id = frame_id_assigner.assign()
+    def __init__(self, frame_type, id_assigner):
+        self.id = id_assigner.assign()
         self.type = frame_type
         self.parent = None
         self.children = []
@@ -376,6 +1056,49 @@ class Frame(object):
         else:
             return "{} {} (Worker {})".format(self.type, self.id, self.worker.id)
 
+    def shown_objects(self):
+        """
+        Return the objects that str(self) shows and that workers other than
+        the one working on the frame can change in place (see
+        Worker.shown_objects). None here.
+        """
+        return ()
+
+    def get_state(self):
+        """Return the frame as plain data, with frames and workers by id."""
+        return {
+            "type": self.type,
+            "worker": None if self.worker is None else self.worker.id,
+            "parent": None if self.parent is None else self.parent.id,
+            "children": [child.id for child in self.children],
+        }
+
+    def __deepcopy__(self, memo):
+        # Copy the whole frame tree at once, linking the copies through
+        # `memo`, instead of recursing along parent and children links, which
+        # overflows the stack on deep trees
+        root = self
+        while root.parent is not None:
+            root = root.parent
+        frames = []
+        to_visit = [root]
+        while to_visit:
+            frame = to_visit.pop()
+            frames.append(frame)
+            memo[id(frame)] = frame.__class__.__new__(frame.__class__)
+            to_visit.extend(frame.children)
+        for frame in frames:
+            copied = memo[id(frame)]
+            for key, val in frame.__dict__.items():
+                if key == "parent":
+                    val = None if val is None else memo[id(val)]
+                elif key == "children":
+                    val = [memo[id(child)] for child in val]
+                else:
+                    val = deepcopy(val, memo)
+                copied.__dict__[key] = val
+        return memo[id(self)]
+
     def attach(self, parent):
         """Add self as child to frame `parent`."""
         assert(self.parent == None)
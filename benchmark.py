@@ -0,0 +1,216 @@
+#####
+#
+# Differential benchmark of the runtime system simulator variants. Feeds one
+# trace of actions through each variant, skipping actions a variant can not
+# parse, and reports wall time, peak memory and per-action latency for each.
+# The frame tree and deques, which all variants have in common, are compared
+# every --check-every actions, and the first divergence from the first
+# variant is reported. The time spent on these comparisons is not part of the
+# wall time.
+#
+# Periodic checkpoints of the RTS state (see RTS.checkpoint) are turned off,
+# so that the times are those of the variants. The state is still
+# checkpointed when an invalid action is rolled back.
+#
+#   python benchmark.py trace.txt --workers 4
+#   python benchmark.py trace.txt --variants base,log_splitter --no-memory
+#   python benchmark.py trace.txt --mode fast
+#
+#####
+
+
+import argparse
+import time
+import tracemalloc
+
+from base_runtime_simulator import RUN_MODES
+from helpers import ActionParseError, InvalidActionError
+from variants import VARIANTS
+
+
+def common_state(rts):
+    """
+    Return a hashable description of the frame tree and worker deques, which
+    is the same in all variants.
+    """
+    deques = tuple(
+        (worker_id, tuple(
+            tuple(frame.id for frame in stacklet.frames)
+            for stacklet in worker.deque
+        ))
+        for worker_id, worker in sorted(rts.workers.items())
+    )
+    frames = []
+    to_visit = [rts.initial_frame]
+    while to_visit:
+        frame = to_visit.pop()
+        frames.append((
+            frame.id, frame.type,
+            None if frame.worker is None else frame.worker.id,
+            tuple(child.id for child in frame.children),
+        ))
+        to_visit.extend(frame.children)
+    return (deques, tuple(frames))
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(p / 100 * len(sorted_values)))
+    return sorted_values[index]
+
+
+def run_variant(module, lines, num_workers, check_every=None,
+                mode="default"):
+    """
+    Perform the actions in `lines` on an RTS of the given variant module, in
+    run mode `mode`. Return a dict of results, including the digest of the
+    common state after every `check_every` lines.
+    """
+    rts = module.RTS(num_workers)
+    rts.set_mode(mode)
+    rts.checkpoint_interval = None
+    latencies = []
+    latency_by_type = {}
+    num_skipped = 0
+    num_invalid = 0
+    digests = {}
+    check_time = 0.0
+    start = time.perf_counter()
+    for i, line in enumerate(lines):
+        try:
+            action = module.parse_action(line)
+        except ActionParseError:
+            num_skipped += 1
+            action = None
+        if action is not None and action.type != "help":
+            action_start = time.perf_counter()
+            try:
+                rts.do_action(action)
+            except InvalidActionError:
+                num_invalid += 1
+                rts.restore()
+            latency = time.perf_counter() - action_start
+            latencies.append(latency)
+            latency_by_type.setdefault(action.type, []).append(latency)
+        if check_every is not None and (i + 1) % check_every == 0:
+            check_start = time.perf_counter()
+            digests[i] = hash(common_state(rts))
+            check_time += time.perf_counter() - check_start
+    wall_time = time.perf_counter() - start - check_time
+    latencies.sort()
+    return {
+        "wall_time": wall_time,
+        "check_time": check_time,
+        "num_actions": len(latencies),
+        "num_skipped": num_skipped,
+        "num_invalid": num_invalid,
+        "latency_mean": sum(latencies) / len(latencies) if latencies else 0.0,
+        "latency_p50": percentile(latencies, 50),
+        "latency_p99": percentile(latencies, 99),
+        "latency_max": latencies[-1] if latencies else 0.0,
+        "latency_by_type": {
+            action_type: sum(values) / len(values)
+            for action_type, values in latency_by_type.items()
+        },
+        "digests": digests,
+        "stats": rts.get_stats()["total"],
+    }
+
+
+def measure_peak_memory(module, lines, num_workers, mode="default"):
+    """Return the peak memory in bytes allocated while running `lines`."""
+    tracemalloc.start()
+    try:
+        run_variant(module, lines, num_workers, mode=mode)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def find_divergence(reference, results):
+    """Return the first line index where the digests differ, or None."""
+    for i in sorted(reference["digests"]):
+        if reference["digests"][i] != results["digests"][i]:
+            return i
+    return None
+
+
+def run_benchmark(lines, variant_names, num_workers=4, check_every=None,
+                  measure_memory=True, mode="default"):
+    """
+    Run the trace `lines` on each variant. Return a dict of results per
+    variant name, with "peak_memory" and "divergence" (line index, or None)
+    added.
+    """
+    lines = [line.strip() for line in lines if line.strip()]
+    all_results = {}
+    for name in variant_names:
+        module = VARIANTS[name]
+        results = run_variant(module, lines, num_workers, check_every, mode)
+        if measure_memory:
+            results["peak_memory"] = measure_peak_memory(module, lines,
+                                                         num_workers, mode)
+        all_results[name] = results
+    reference = all_results[variant_names[0]]
+    for results in all_results.values():
+        results["divergence"] = find_divergence(reference, results)
+    return all_results
+
+
+def format_results(all_results, lines):
+    lines = [line.strip() for line in lines if line.strip()]
+    rows = [("variant", "actions", "skipped", "invalid", "wall (s)",
+             "mean (us)", "p50 (us)", "p99 (us)", "max (us)", "peak (KiB)")]
+    for name, results in all_results.items():
+        peak = results.get("peak_memory")
+        rows.append((
+            name, str(results["num_actions"]), str(results["num_skipped"]),
+            str(results["num_invalid"]),
+            "{:.3f}".format(results["wall_time"]),
+            "{:.1f}".format(results["latency_mean"] * 1e6),
+            "{:.1f}".format(results["latency_p50"] * 1e6),
+            "{:.1f}".format(results["latency_p99"] * 1e6),
+            "{:.1f}".format(results["latency_max"] * 1e6),
+            "-" if peak is None else "{:.0f}".format(peak / 1024),
+        ))
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    str_comp = []
+    for row in rows:
+        str_comp.append("  ".join(
+            cell.ljust(width) for cell, width in zip(row, widths)))
+        str_comp.append("\n")
+    str_comp.append("\n")
+    for name, results in all_results.items():
+        if results["divergence"] is not None:
+            i = results["divergence"]
+            str_comp.append("{} diverges after line {}: {}\n".format(
+                name, i + 1, lines[i]))
+    return "".join(str_comp)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("file", help="file with newline separated commands")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--variants", default=",".join(VARIANTS),
+                        help="comma separated variants, the first one is the "
+                             "reference for divergences")
+    parser.add_argument("--check-every", type=int, default=100, metavar="K",
+                        help="compare common state every K lines")
+    parser.add_argument("--no-memory", action="store_true",
+                        help="skip the peak memory measurement pass")
+    parser.add_argument("--mode", choices=RUN_MODES, default="default",
+                        help="run mode of the RTSs, see RTS.set_mode")
+    args = parser.parse_args()
+    with open(args.file, "r") as f:
+        lines = f.readlines()
+    all_results = run_benchmark(lines, args.variants.split(","), args.workers,
+                                args.check_every, not args.no_memory,
+                                args.mode)
+    print(format_results(all_results, lines), end="")
+
+
+if __name__ == "__main__":
+    main()
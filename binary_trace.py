@@ -0,0 +1,256 @@
+#####
+#
+# Compact binary encoding of action traces, and conversion to and from the
+# text format. To convert, run
+#
+#   python binary_trace.py encode trace.txt trace.bin
+#   python binary_trace.py decode trace.bin trace.txt
+#
+# A binary trace is the magic bytes "CRTS", a version byte, and a sequence of
+# records. Each record starts with an opcode byte:
+#
+# action opcode    followed by the fields of the action (see OPCODE_ACTIONS).
+#                  Worker ids are stored as their offset from "A", other
+#                  fields (splitter names and values) as their index in the
+#                  value table. Numbers are unsigned LEB128 varints.
+# DEFINE_VALUE     followed by the length and UTF-8 bytes of a string, which
+#                  is added to the value table. Values are defined right
+#                  before their first use.
+# RAW_LINE         followed by the length and UTF-8 bytes of a line that can
+#                  not be encoded as an action, e.g. a malformed one.
+#
+# Decoding a binary trace gives back the text trace, without blank lines and
+# with whitespace between tokens normalized to single spaces.
+#
+#####
+
+
+import argparse
+import mmap
+import sys
+
+from base_runtime_simulator import WORKER_ARGS
+from helpers import Action
+from variants import VARIANTS
+
+
+MAGIC = b"CRTS"
+VERSION = 1
+
+WORKER = "worker"
+VALUE = "value"
+OMITTED = "omitted"  # optional argument that is not stored, None when read
+
+# The actions of all simulator variants, by type
+ACTION_SPECS = {}
+for _variant in VARIANTS.values():
+    ACTION_SPECS.update(_variant.RTS.action_registry.specs)
+
+# Action forms, as (action type, number of arguments), in opcode order. An
+# action type with optional arguments has a form for each number of them.
+# Forms are only ever appended, so that the opcodes of existing traces do not
+# change. Actions of other forms are stored as raw lines.
+OPCODE_ACTIONS = (
+    ("undo", 0), ("help", 0), ("call", 1), ("spawn", 1), ("return", 1),
+    ("steal", 2), ("sync", 1), ("push", 2), ("set", 3), ("pop", 2),
+    ("access", 2), ("write", 3), ("steal", 1),
+)
+OPCODES = {form: i for i, form in enumerate(OPCODE_ACTIONS)}
+
+
+def _form_fields(action_type, num_args):
+    """
+    Return the fields of an action form, in order, as (attribute, kind), from
+    the arguments of its action type. The optional arguments that the form
+    omits come last.
+    """
+    spec = ACTION_SPECS[action_type]
+    assert len(spec.args) - spec.num_optional <= num_args <= len(spec.args)
+    return tuple(
+        (arg, OMITTED if i >= num_args else
+         WORKER if arg in WORKER_ARGS else VALUE)
+        for i, arg in enumerate(spec.args))
+
+
+# Fields of the action form of each opcode
+OPCODE_FIELDS = [_form_fields(*form) for form in OPCODE_ACTIONS]
+DEFINE_VALUE = 0xfe
+RAW_LINE = 0xff
+
+
+class TraceFormatError(Exception):
+    pass
+
+
+def format_action(action):
+    """Return the text form of an action, without its omitted arguments."""
+    return " ".join([action.type] + [
+        getattr(action, arg) for arg in ACTION_SPECS[action.type].args
+        if getattr(action, arg) is not None
+    ])
+
+
+def _encode_varint(n, out):
+    while n >= 0x80:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _encode_string(s, out):
+    data = s.encode("utf-8")
+    _encode_varint(len(data), out)
+    out.extend(data)
+
+
+def _is_worker_id(s):
+    return len(s) == 1 and ord(s) >= 65
+
+
+class TraceWriter(object):
+    """Writes lines of a text trace to a binary file object."""
+    def __init__(self, f):
+        self.f = f
+        self.values = {}  # value -> index in value table
+        self.f.write(MAGIC + bytes([VERSION]))
+
+    def write_line(self, line):
+        s_comp = line.split()
+        if not s_comp:
+            return
+        out = bytearray()
+        opcode = OPCODES.get((s_comp[0], len(s_comp) - 1))
+        fields = None if opcode is None else OPCODE_FIELDS[opcode]
+        if (
+            fields is None or
+            not all(_is_worker_id(token)
+                    for token, (_, kind) in zip(s_comp[1:], fields)
+                    if kind == WORKER)
+        ):
+            out.append(RAW_LINE)
+            _encode_string(" ".join(s_comp), out)
+            self.f.write(out)
+            return
+        record = bytearray([opcode])
+        for token, (_, kind) in zip(s_comp[1:], fields):
+            if kind == WORKER:
+                _encode_varint(ord(token) - 65, record)
+            else:
+                if token not in self.values:
+                    self.values[token] = len(self.values)
+                    out.append(DEFINE_VALUE)
+                    _encode_string(token, out)
+                _encode_varint(self.values[token], record)
+        out.extend(record)
+        self.f.write(out)
+
+
+def encode(lines, f):
+    """Write the text trace `lines` to binary file object `f`."""
+    writer = TraceWriter(f)
+    for line in lines:
+        writer.write_line(line)
+
+
+def read_trace(path):
+    """
+    Generate the records of the binary trace at `path`, reading it through
+    mmap. Actions are generated as Action objects, raw lines as strings,
+    which still need to be parsed.
+    """
+    with open(path, "rb") as f:
+        header = f.read(len(MAGIC) + 1)
+        if header[:len(MAGIC)] != MAGIC:
+            raise TraceFormatError("{} is not a binary trace".format(path))
+        if header[len(MAGIC)] != VERSION:
+            raise TraceFormatError("Unsupported trace version {}".format(
+                header[len(MAGIC)]))
+        if f.seek(0, 2) == len(header):  # mmap can not map an empty range
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            yield from _read_records(m, len(header))
+
+
+def _read_records(m, pos):
+    values = []
+    end = len(m)
+
+    def read_varint():
+        nonlocal pos
+        n = 0
+        shift = 0
+        while True:
+            byte = m[pos]
+            pos += 1
+            n |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                return n
+            shift += 7
+
+    def read_string():
+        nonlocal pos
+        length = read_varint()
+        s = m[pos:pos + length].decode("utf-8")
+        pos += length
+        return s
+
+    try:
+        while pos < end:
+            opcode = m[pos]
+            pos += 1
+            if opcode == DEFINE_VALUE:
+                values.append(read_string())
+            elif opcode == RAW_LINE:
+                yield read_string()
+            elif opcode < len(OPCODE_ACTIONS):
+                action = Action(OPCODE_ACTIONS[opcode][0])
+                # Filled in directly, which is faster than setattr, or than
+                # collecting the fields first
+                attrs = action.__dict__
+                for attr, kind in OPCODE_FIELDS[opcode]:
+                    attrs[attr] = (chr(65 + read_varint()) if kind == WORKER
+                                   else values[read_varint()] if kind == VALUE
+                                   else None)
+                yield action
+            else:
+                raise TraceFormatError("Unknown opcode {} at byte {}".format(
+                    opcode, pos - 1))
+    except IndexError:
+        raise TraceFormatError("Truncated trace")
+
+
+def read_lines(path):
+    """Generate the lines of the text trace of the binary trace at `path`."""
+    for record in read_trace(path):
+        yield record if isinstance(record, str) else format_action(record)
+
+
+def is_binary_trace(path):
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["encode", "decode"])
+    parser.add_argument("input")
+    parser.add_argument("output", nargs="?",
+                        help="output file, stdout when decoding if omitted")
+    args = parser.parse_args()
+    if args.command == "encode":
+        if args.output is None:
+            parser.error("encode needs an output file")
+        with open(args.input, "r") as f_in, open(args.output, "wb") as f_out:
+            encode(f_in, f_out)
+    else:
+        if args.output is None:
+            for line in read_lines(args.input):
+                sys.stdout.write(line + "\n")
+        else:
+            with open(args.output, "w") as f_out:
+                for line in read_lines(args.input):
+                    f_out.write(line + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+#####
+#
+# Compact storage of frames, for simulations with many live frames. An RTS
+# created with compact_frames=True keeps its frames in a FrameStore: each
+# frame is an integer handle into typed arrays for its id, type, worker,
+# depth, and parent/children links, which are kept as first child, last
+# child and prev/next sibling. Attributes specific to a simulator variant
+# (e.g. hypermaps or records) are kept in side tables, which only have
+# entries for frames where they are set.
+#
+# Frames are accessed through views, which are created on demand and are
+# instances of the variant's Frame class, so the Frame API works unchanged.
+# Two views of the same frame are equal, but not necessarily identical.
+#
+#####
+
+
+from array import array
+from copy import copy, deepcopy
+
+from helpers import IDAssigner
+
+
+FRAME_TYPES = ("initial", "spawn", "call")
+NIL = -1  # no frame/worker
+
+
+class FrameView(object):
+    """Frame stored in a FrameStore, the handle of which is `handle`."""
+    __slots__ = ("store", "handle")
+
+    def __getattr__(self, name):
+        # Only called for attributes that are not found otherwise
+        if name.startswith("__") or name in FrameView.__slots__:
+            raise AttributeError(name)
+        return self.store.get_side(self.handle, name)
+
+    def __setattr__(self, name, value):
+        if name in _VIEW_ATTRS:
+            object.__setattr__(self, name, value)
+        else:
+            self.store.set_side(self.handle, name, value)
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, FrameView) and
+            self.handle == other.handle and self.store is other.store
+        )
+
+    def __hash__(self):
+        return hash(self.handle)
+
+    def __deepcopy__(self, memo):
+        # Not the one of the Frame class: the links are in the store, which
+        # may still be being copied
+        view = self.__class__.__new__(self.__class__)
+        object.__setattr__(view, "store", deepcopy(self.store, memo))
+        object.__setattr__(view, "handle", self.handle)
+        return view
+
+    @property
+    def id(self):
+        return self.store.ids[self.handle]
+
+    @property
+    def type(self):
+        return FRAME_TYPES[self.store.types[self.handle]]
+
+    @property
+    def parent(self):
+        return self.store.view(self.store.parents[self.handle])
+
+    @property
+    def children(self):
+        """List of the children, in the order they were attached."""
+        store = self.store
+        children = []
+        child = store.first_children[self.handle]
+        while child != NIL:
+            children.append(store.view(child))
+            child = store.next_siblings[child]
+        return children
+
+    @property
+    def worker(self):
+        return self.store.get_worker(self.handle)
+
+    @worker.setter
+    def worker(self, worker):
+        self.store.set_worker(self.handle, worker)
+
+    @property
+    def depth(self):
+        return self.store.depths[self.handle]
+
+    def get_depth(self):
+        """Return the spawn depth of the frame."""
+        return self.store.depths[self.handle]
+
+    def attach(self, parent):
+        """Add self as child to frame `parent`."""
+        self.store.attach(self.handle, parent.handle)
+
+    def detach(self):
+        """Remove self as child to parent frame."""
+        self.store.detach(self.handle)
+
+
+_VIEW_ATTRS = {
+    name for name in vars(FrameView)
+    if isinstance(vars(FrameView)[name], property)
+} | set(FrameView.__slots__)
+
+
+class FrameStore(object):
+    """
+    Frames of an RTS in typed arrays, indexed by handle. Handles of frames
+    that are released are reused.
+    """
+    def __init__(self, frame_class):
+        """
+        `frame_class` is the Frame class of the variant. The views of stored
+        frames are instances of it, and the attributes its __init__ sets on
+        top of the base Frame are kept in side tables.
+        """
+        self.view_class = _view_class(frame_class)
+        self.ids = array('q')
+        self.types = array('b')
+        self.workers = array('h')  # index in worker_table, or NIL
+        self.depths = array('i')  # spawn depth
+        self.parents = array('i')
+        self.first_children = array('i')
+        self.last_children = array('i')
+        self.prev_siblings = array('i')
+        self.next_siblings = array('i')
+        self.worker_table = []
+        self.worker_indices = {}  # worker id -> index in worker_table
+        # Attribute name -> {handle: value}, with defaults for unset values
+        self.side_defaults = _side_defaults(frame_class)
+        self.side_tables = {name: {} for name in self.side_defaults}
+        self.free_handles = []
+
+    def __len__(self):
+        """Return the number of live frames."""
+        return len(self.ids) - len(self.free_handles)
+
+    def new_frame(self, frame_type, frame_id):
+        """Allocate a frame and return its view."""
+        depth = 1 if frame_type == "spawn" else 0
+        columns = (
+            (self.ids, frame_id), (self.types, FRAME_TYPES.index(frame_type)),
+            (self.workers, NIL), (self.depths, depth), (self.parents, NIL),
+            (self.first_children, NIL), (self.last_children, NIL),
+            (self.prev_siblings, NIL), (self.next_siblings, NIL),
+        )
+        if self.free_handles:
+            handle = self.free_handles.pop()
+            for column, value in columns:
+                column[handle] = value
+        else:
+            handle = len(self.ids)
+            for column, value in columns:
+                column.append(value)
+        return self.view(handle)
+
+    def release(self, frame):
+        """Free a frame that is no longer part of the simulation."""
+        handle = frame.handle
+        assert(self.parents[handle] == NIL and
+               self.first_children[handle] == NIL)
+        for table in self.side_tables.values():
+            table.pop(handle, None)
+        self.workers[handle] = NIL
+        self.free_handles.append(handle)
+
+    def view(self, handle):
+        """Return a view of the frame `handle`, None for NIL."""
+        if handle == NIL:
+            return None
+        view = self.view_class.__new__(self.view_class)
+        object.__setattr__(view, "store", self)
+        object.__setattr__(view, "handle", handle)
+        return view
+
+    def get_worker(self, handle):
+        index = self.workers[handle]
+        return None if index == NIL else self.worker_table[index]
+
+    def set_worker(self, handle, worker):
+        if worker is None:
+            self.workers[handle] = NIL
+            return
+        if worker.id not in self.worker_indices:
+            self.worker_indices[worker.id] = len(self.worker_table)
+            self.worker_table.append(worker)
+        self.workers[handle] = self.worker_indices[worker.id]
+
+    def attach(self, handle, parent):
+        assert(self.parents[handle] == NIL)
+        self.parents[handle] = parent
+        last = self.last_children[parent]
+        self.prev_siblings[handle] = last
+        if last == NIL:
+            self.first_children[parent] = handle
+        else:
+            self.next_siblings[last] = handle
+        self.last_children[parent] = handle
+        self.depths[handle] = (
+            self.depths[parent] + (1 if FRAME_TYPES[self.types[handle]] ==
+                                   "spawn" else 0)
+        )
+
+    def detach(self, handle):
+        parent = self.parents[handle]
+        prev, next_ = self.prev_siblings[handle], self.next_siblings[handle]
+        if prev == NIL:
+            self.first_children[parent] = next_
+        else:
+            self.next_siblings[prev] = next_
+        if next_ == NIL:
+            self.last_children[parent] = prev
+        else:
+            self.prev_siblings[next_] = prev
+        self.parents[handle] = NIL
+        self.prev_siblings[handle] = NIL
+        self.next_siblings[handle] = NIL
+        self.depths[handle] = (
+            1 if FRAME_TYPES[self.types[handle]] == "spawn" else 0)
+
+    def get_side(self, handle, name):
+        if name not in self.side_tables:
+            raise AttributeError(name)
+        table = self.side_tables[name]
+        if handle in table:
+            return table[handle]
+        return copy(self.side_defaults[name])
+
+    def set_side(self, handle, name, value):
+        if name not in self.side_tables:
+            raise AttributeError("Frames have no attribute {}".format(name))
+        self.side_tables[name][handle] = value
+
+
+_view_classes = {}  # frame class -> view class
+
+
+def _view_class(frame_class):
+    """Return a view class that is a subclass of `frame_class`."""
+    if frame_class not in _view_classes:
+        _view_classes[frame_class] = type(
+            "Stored" + frame_class.__name__, (FrameView, frame_class),
+            {"__slots__": (), "__module__": frame_class.__module__})
+    return _view_classes[frame_class]
+
+
+def _side_defaults(frame_class):
+    """
+    Return the attributes a new frame of `frame_class` has, other than the
+    ones kept in the arrays, with their initial values.
+    """
+    frame = frame_class("call", IDAssigner())
+    return {
+        name: value for name, value in vars(frame).items()
+        if name not in _VIEW_ATTRS
+    }
@@ -1,3 +1,6 @@
+from copy import deepcopy
+
+
 enclosed_alp = [
     '\u249C', '\u249D', '\u249E', '\u249F', '\u24A0', '\u24A1',
     '\u24A2', '\u24A3', '\u24A4', '\u24A5', '\u24A6', '\u24A7',
@@ -46,9 +49,6 @@ class SymbolAssigner(object):
         self.symbol_index = 0
 
 
-node_symbol_assigner = SymbolAssigner()
-
-
 class IDAssigner(object):
     def __init__(self):
         self.ID = 0
@@ -62,7 +62,96 @@ class IDAssigner(object):
         self.ID = 0
 
 
-frame_id_assigner = IDAssigner()
+class ViewRegistry(object):
+    """
+    Tracks the lifetime of the views of an RTS. Views are registered when
+    allocated and unregistered when destroyed.
+    """
+    def __init__(self):
+        self.live = {}  # serial number -> view, in order of allocation
+        self.num_allocated = 0
+        self.num_destroyed = 0
+        self.max_live = 0  # high-water mark of len(self.live)
+
+    def __len__(self):
+        return len(self.live)
+
+    def __contains__(self, view):
+        return self.live.get(view.serial) is view
+
+    def __str__(self):
+        return str(list(self.live.values()))
+
+    def allocate(self, view):
+        view.serial = self.num_allocated
+        self.num_allocated += 1
+        self.live[view.serial] = view
+        self.max_live = max(self.max_live, len(self.live))
+
+    def destroy(self, view):
+        assert(view in self)  # views are destroyed once
+        del self.live[view.serial]
+        self.num_destroyed += 1
+
+    def destroy_all(self, views):
+        """Destroy a batch of views, e.g. the ones dropped by a merge."""
+        live = self.live
+        for view in views:
+            assert(live.get(view.serial) is view)  # views are destroyed once
+            del live[view.serial]
+        self.num_destroyed += len(views)
+
+    def find_leaks(self, reachable):
+        """
+        Given the views reachable from the state of the RTS, return the live
+        views that are not reachable (leaked) and the reachable views that
+        were destroyed (dangling).
+        """
+        reachable_ids = {id(view) for view in reachable}
+        leaked = [
+            view for view in self.live.values()
+            if id(view) not in reachable_ids
+        ]
+        dangling = [view for view in reachable if view not in self]
+        return leaked, dangling
+
+    def get_stats(self):
+        return {
+            "views_allocated": self.num_allocated,
+            "views_destroyed": self.num_destroyed,
+            "live_views": len(self.live),
+            "max_live_views": self.max_live,
+        }
+
+
+def views_with_parents(views):
+    """Return the list of `views` and all views on their parent chains."""
+    seen = {}
+    for view in views:
+        while view is not None and id(view) not in seen:
+            seen[id(view)] = view
+            view = view.parent
+    return list(seen.values())
+
+
+def deepcopy_chain(obj, memo, link="parent"):
+    """
+    Deep copy `obj`, which is on a chain of objects linked by attribute
+    `link` (e.g. a view and its parents), for use in __deepcopy__. The part
+    of the chain that is not copied yet is copied from its far end, so that
+    each link is already in `memo` when it is reached, instead of recursing
+    along the chain.
+    """
+    first = obj
+    chain = []
+    while obj is not None and id(obj) not in memo:
+        chain.append(obj)
+        obj = getattr(obj, link)
+    for obj in reversed(chain):
+        copied = obj.__class__.__new__(obj.__class__)
+        memo[id(obj)] = copied
+        copied.__dict__.update(deepcopy(obj.__dict__, memo))
+    return memo[id(first)]
 
 
 class InvalidActionError(Exception):
@@ -73,6 +162,11 @@ class ActionParseError(Exception):
     pass
 
 
+class InvariantError(Exception):
+    """A structural invariant of the RTS state does not hold."""
+    pass
+
+
 class Action(object):
     """
     Stores an action and the worker(s) involved in the action. E.g. spawn,
@@ -80,5 +174,100 @@ class Action(object):
     """
     def __init__(self, action_type, **kwargs):
         self.type = action_type
-        for key, val in kwargs.items():
-            setattr(self, key, val)
+        self.__dict__.update(kwargs)
+
+
+class ActionResult(object):
+    """
+    Outcome of one action run by RTS.run: the action, which is None if it
+    could not be parsed, and on failure the kind of error ("parse" or
+    "invalid") and its reason.
+    """
+    def __init__(self, index, action, error=None, reason=None):
+        self.index = index  # position in the actions run
+        self.action = action
+        self.error = error
+        self.reason = reason
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        if self.ok:
+            return "ActionResult({}, ok)".format(self.index)
+        return "ActionResult({}, {}: {})".format(self.index, self.error,
+                                                 self.reason)
+
+
+class ActionSpec(object):
+    """
+    An action type: the attributes its arguments are parsed to, in order, of
+    which the last `num_optional` may be omitted (and are then None), the
+    function performing it on an RTS, and its usage line for help.
+    """
+    def __init__(self, action_type, args, num_optional, handler, usage,
+                 recorded):
+        self.type = action_type
+        self.args = args
+        self.num_optional = num_optional
+        self.handler = handler
+        self.usage = usage
+        self.recorded = recorded  # whether performed actions enter history
+
+
+class ActionRegistry(object):
+    """
+    The action types a simulator supports, by name. Each variant starts from
+    a copy of the registry of the simulator it extends and registers its own
+    actions, so parsing and dispatching an action is a single lookup.
+    """
+    def __init__(self, specs=None):
+        self.specs = {} if specs is None else dict(specs)
+
+    def __contains__(self, action_type):
+        return action_type in self.specs
+
+    def __getitem__(self, action_type):
+        return self.specs[action_type]
+
+    def copy(self):
+        return ActionRegistry(self.specs)
+
+    def register(self, action_type, args=(), num_optional=0, usage=None,
+                 recorded=True):
+        """
+        Decorator registering a handler(rts, action) for `action_type`. A
+        handler may return the action to record in the history instead of
+        the one performed, e.g. with defaults filled in.
+        """
+        if usage is None:
+            usage = " ".join((action_type,) + tuple(
+                "({})".format(arg.replace("_", " ")) for arg in args))
+
+        def decorator(handler):
+            self.specs[action_type] = ActionSpec(
+                action_type, tuple(args), num_optional, handler, usage,
+                recorded)
+            return handler
+        return decorator
+
+    def parse(self, s):
+        """Parse string s, return an Action object."""
+        s_comp = s.split()
+        spec = self.specs.get(s_comp[0]) if s_comp else None
+        if spec is None:
+            raise ActionParseError()
+        num_args = len(s_comp) - 1
+        if not (len(spec.args) - spec.num_optional <= num_args <=
+                len(spec.args)):
+            raise ActionParseError()
+        action = Action(spec.type)
+        action.__dict__.update(zip(spec.args, s_comp[1:]))
+        for arg in spec.args[num_args:]:
+            setattr(action, arg, None)
+        return action
+
+    def help_text(self):
+        return "Options:\n{}\n\n".format(
+            "\n".join(spec.usage for spec in self.specs.values()))
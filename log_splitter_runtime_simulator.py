@@ -8,86 +8,103 @@
 #####
 
 
+from array import array
+from collections import deque
 from copy import copy
 
+from frame_store import FrameStore
 from helpers import (
-    color, frame_id_assigner, node_symbol_assigner, InvalidActionError,
-    ActionParseError, Action
+    color, IDAssigner, SymbolAssigner, InvalidActionError, InvariantError
 )
 import base_runtime_simulator as base
 
 
-def parse_action(s):
-    try:
-        s_comp = s.split()
-        action_type = s_comp[0]
-        if action_type == "access":
-            action = Action(action_type, worker_id=s_comp[1],
-                            splitter_name=s_comp[2])
-        elif action_type == "write":
-            action = Action(action_type, worker_id=s_comp[1],
-                            splitter_name=s_comp[2], splitter_value=s_comp[3])
-        else:
-            action = base.parse_action(s)
-        return action
-    except Exception:
-        raise ActionParseError()
+# Action types of the base simulator, and the splitter actions
+ACTIONS = base.ACTIONS.copy()
+
+
+@ACTIONS.register("access", ("worker_id", "splitter_name"))
+def _access(rts, action):
+    worker = rts.get_worker(action.worker_id)
+    worker.access(action.splitter_name)
+    worker.counters["splitter_access"] += 1
+
+
+@ACTIONS.register("write", ("worker_id", "splitter_name", "splitter_value"))
+def _write(rts, action):
+    worker = rts.get_worker(action.worker_id)
+    worker.write(action.splitter_name, action.splitter_value)
+    worker.counters["splitter_write"] += 1
+
+
+parse_action = ACTIONS.parse
+
+
+DEFAULT_SPLITTER_NAMES = ('W', 'X', 'Y', 'Z')
 
 
 class RTS(base.RTS):
-    def __init__(self, num_workers):
-        frame_id_assigner.reset()
-        node_symbol_assigner.reset()
+    action_registry = ACTIONS
+
+    def __init__(self, num_workers, splitter_names=DEFAULT_SPLITTER_NAMES,
+                 compact_frames=False):
+        """
+        `splitter_names` lists the splitters held in the splitter tree, e.g.
+        ["s{}".format(i) for i in range(1000)] for a thousand splitters.
+        """
+        self.frame_id_assigner = IDAssigner()
+        self.frame_store = FrameStore(Frame) if compact_frames else None
+        self.node_symbol_assigner = SymbolAssigner()
         self.num_workers = num_workers
         # Initialize blank workers
         self.workers = {}
         for i in range(self.num_workers):
             worker_id = chr(65 + i)  # chr(65) = A
-            self.workers[worker_id] = Worker(worker_id)
+            self.workers[worker_id] = Worker(worker_id, self.frame_id_assigner,
+                                             self.frame_store)
         # One worker starts with initial frame
-        self.initial_frame = Frame("initial")
+        self.initial_frame = self.workers['A'].new_frame("initial")
         init_worker = self.workers['A']
         init_worker.deque.push(base.Stacklet(self.initial_frame))
         self.initial_frame.worker = self.workers['A']
         # That worker starts with a basic record
-        init_worker.record_deque.append(Record())
+        init_worker.record_deque.append(Record(SplitterTree(
+            splitter_names, self.node_symbol_assigner)))
         # Starts with an area for complex allocations
         init_complex_alloc_group = []
         init_worker.complex_alloc_group = init_complex_alloc_group
         init_worker.cur_record.complex_log.append(init_complex_alloc_group)
         # Keep track of all actions, for restoring
-        self.actions = []
-
-    def do_action(self, action):
-        if action.type == "help":
-            print(color(
-                "Options:\n"
-                "undo\n"
-                "call (worker id)\n"
-                "spawn (worker id)\n"
-                "return (worker id)\n"
-                "steal (thief id) (victim id)\n"
-                "sync (worker id)\n"
-                "access (worker id) (splitter name)\n"
-                "write (worker id) (splitter name) (splitter value)\n\n",
-                "red"
-            ))
-        elif action.type == "access":
-            worker = self.get_worker(action.worker_id)
-            worker.access(action.splitter_name)
-            self.actions.append(action)
-        elif action.type == "write":
-            worker = self.get_worker(action.worker_id)
-            worker.write(action.splitter_name, action.splitter_value)
-            self.actions.append(action)
-        else:  # base action
-            super().do_action(action)
+        self._init_history()
+
+    def verify(self):
+        """
+        Check the invariants of the base RTS, that spawn depths match the
+        frame tree, and that suspended frames hold all of their record, cache
+        and complex allocation group or none.
+        """
+        super().verify()
+        for frame in self._iter_frames():
+            depth = 1 if frame.type == "spawn" else 0
+            if frame.parent is not None:
+                depth += frame.parent.get_depth()
+            if frame.get_depth() != depth:
+                raise InvariantError("Frame {} has depth {}, expected "
+                                     "{}.".format(frame.id, frame.get_depth(),
+                                                  depth))
+            state = (frame.record, frame.cache, frame.complex_alloc_group)
+            if any(x is None for x in state) != all(
+                    x is None for x in state):
+                raise InvariantError("Frame {} holds only some of its record, "
+                                     "cache and complex allocation "
+                                     "group.".format(frame.id))
 
 
 class Worker(base.Worker):
-    def __init__(self, id_):
-        super().__init__(id_)
-        self.record_deque = []  # list of records
+    def __init__(self, id_, frame_id_assigner, frame_store=None):
+        super().__init__(id_, frame_id_assigner, frame_store)
+        self.frame_class = Frame
+        self.record_deque = deque()  # records, parallel to the deque
         self.cache = set()  # Just splitter name is ok, just maps to the leaf
         # A list belonging to some complex log, containing the symbols for the
         # complex allocations in this execution chunk
@@ -102,26 +119,60 @@ class Worker(base.Worker):
     def cur_tree(self):
         return self.cur_record.tree
 
+    def verify(self):
+        """
+        Check the invariants of the deque, that there is a record per
+        stacklet, with leaf arrays in increasing order of depth, and that the
+        worker has a complex allocation group if and only if it has work.
+        """
+        super().verify()
+        if len(self.record_deque) != len(self.deque):
+            raise InvariantError("Worker {} has {} stacklets, but {} "
+                                 "records.".format(self.id, len(self.deque),
+                                                   len(self.record_deque)))
+        for record in self.record_deque:
+            tree = record.tree
+            for splitter_name in tree.splitter_names:
+                depths = tree.get_leaf_array(splitter_name).depths
+                if any(d1 >= d2 for d1, d2 in zip(depths, depths[1:])):
+                    raise InvariantError("Leaf array of splitter {} of worker "
+                                         "{} is not in increasing order of "
+                                         "depth.".format(splitter_name,
+                                                         self.id))
+        if (self.complex_alloc_group is None) != self.deque.is_empty():
+            raise InvariantError("Worker {} has a complex allocation group if "
+                                 "and only if its deque is empty.".format(
+                                     self.id))
+
     def access(self, splitter_name):
         if self.deque.is_empty():
             raise InvalidActionError("Cannot access splitter from empty worker")
         leaf_array = self.cur_record.tree.get_leaf_array(splitter_name)
         if splitter_name in self.cache:
+            self.counters["access_hit"] += 1
             return leaf_array[-1][1]  # last pair, value in (d, v) pair has index 1
         # Otherwise, not in cache
         # First, figure out right depth to search at
         search_d = self.cur_tree.get_depth(splitter_name)
         assert(search_d is not None)
         # Second, search for the right value
-        target_v = self.cur_tree.search_leaf(splitter_name, search_d)
+        target_v, probes = self.cur_tree.search_leaf(splitter_name, search_d)
         # Third, update complex log
         assert(self.complex_alloc_group is not None)
-        self.complex_alloc_group.append(node_symbol_assigner.cur_symbol())
+        self.complex_alloc_group.append(
+            self.cur_tree.symbol_assigner.cur_symbol())
         # Fourth, path copy
         new_tree = self.cur_tree.path_copy(splitter_name, target_v)
         # Finally, update record and cache
         self.cur_record.tree = new_tree
         self.cache.add(splitter_name)
+        # Cost of the access
+        self.counters["access_miss"] += 1
+        self.counters["search_probes"] += probes
+        self.counters["path_copy_nodes"] += new_tree.allocated_nodes
+        self.counters["complex_log_allocs"] += 1
+        self.histograms["search_probes"][(search_d, probes)] += 1
+        self.histograms["path_copy_nodes"][new_tree.allocated_nodes] += 1
 
     def write(self, splitter_name, new_v):
         if self.deque.is_empty():
@@ -143,7 +194,7 @@ class Worker(base.Worker):
 
     def spawn(self):
         self.check_spawn_valid()
-        new_frame = Frame("spawn")
+        new_frame = self.new_frame("spawn")
         new_frame.worker = self
         new_frame.attach(self.deque.youngest_frame)
         # Append to deque
@@ -175,7 +226,7 @@ class Worker(base.Worker):
 
     def call(self):
         self.check_call_valid()
-        new_frame = Frame("call")
+        new_frame = self.new_frame("call")
         new_frame.worker = self
         self.deque.youngest_stacklet.push(new_frame)
 
@@ -195,11 +246,13 @@ class Worker(base.Worker):
 
     def steal(self, victim):
         super().steal(victim)
-        stolen_record = victim.record_deque.pop(0)
+        stolen_record = victim.record_deque.popleft()
+        assert(len(victim.deque) == len(victim.record_deque))
         assert(len(self.record_deque) == 0)
         # Perform root copy at the right depth
         stolen_depth = self.deque.youngest_frame.get_depth()
         new_tree = stolen_record.tree.root_copy(stolen_depth)
+        self.counters["root_copy_nodes"] += new_tree.allocated_nodes
         stolen_record.tree = new_tree
         self.record_deque.append(stolen_record)
         # Complex log tracking
@@ -227,6 +280,19 @@ class Worker(base.Worker):
             self.complex_alloc_group = None
             self.provably_good_steal(frame)
 
+    def get_state(self):
+        """
+        Return the state of the worker as plain data, with the record of each
+        stacklet (see Record.get_state) and the cached splitters.
+        """
+        state = super().get_state()
+        state["records"] = [record.get_state() for record in self.record_deque]
+        state["cache"] = sorted(self.cache)
+        state["complex_alloc_group"] = (
+            None if self.complex_alloc_group is None
+            else list(self.complex_alloc_group))
+        return state
+
     def print_state(self):
         str_comp = []
         assert(len(self.deque) == len(self.record_deque))
@@ -254,177 +320,270 @@ class Record(object):
             self.tree, self.simple_log, self.complex_log)
         return s
 
-
-class SplitterTree(object):
-    def __init__(self):
+    def get_state(self):
         """
-        Holds 4 splitters.
+        Return the record as plain data: the (d, v) pairs at each leaf of the
+        splitter tree, by splitter name, and the logs.
         """
-        # d values recorded in order from top to bottom, left to right
-        # self.d_values = [' ', ' ', ' ', ' ', ' ', ' ']  # space = NIL
-        self.d_values = [0, 0, ' ', ' ', ' ', ' ']  # space = NIL
-        self.splitter_names = ['W', 'X', 'Y', 'Z']
-        self.leaf_arrays = [
-            [(-1, "init-W")],  # depth of -1, same idea as depth of -infty
-            [(-1, "init-X")],
-            [(-1, "init-Y")],
-            [(-1, "init-Z")],
-        ]
-        self.node_symbols = ['.', '.', '.']  # How the non-leaf nodes are displayed
+        return {
+            "tree": {
+                name: [list(pair) for pair in self.tree.get_leaf_array(name)]
+                for name in self.tree.splitter_names
+            },
+            "simple_log": list(self.simple_log),
+            "complex_log": [list(group) for group in self.complex_log],
+        }
+
+
+class LeafArray(object):
+    """
+    Array of (d, v) pairs at a leaf of a SplitterTree, in increasing order of
+    d. The d values are kept in a contiguous array for binary search.
+    """
+    def __init__(self, d, v):
+        self.depths = array('q', [d])
+        self.values = [v]
+
+    def __len__(self):
+        return len(self.depths)
+
+    def __getitem__(self, index):
+        return (self.depths[index], self.values[index])
+
+    def __setitem__(self, index, pair):
+        self.depths[index], self.values[index] = pair
+
+    def __iter__(self):
+        yield from zip(self.depths, self.values)
 
     def __str__(self):
-        #       .
-        #      / \
-        #    1/   \2
-        #    /     \
-        #   .       . 
-        # 3/ \4   5/ \6
-        # W   X   Y   Z
-        # array contents on the right of the tree
-        lines = [
-            "      {}".format(self.node_symbols[0]),
-            "     / \\",
-            "   {}/   \\{}".format(*self.d_values[:2]),
-            "   /     \\",
-            "  {}       {}".format(*self.node_symbols[1:]),
-            "{}/ \\{}   {}/ \\{}".format(*self.d_values[2:]),
-            "W   X   Y   Z",
-        ]
-        lines = [line.ljust(25) for line in lines]
-        # Put array contents on the right
-        for i, (name, array) in enumerate(zip(self.splitter_names, self.leaf_arrays)):
-            lines[i + 2] += "{}: {}".format(name, array)
-        return '\n'.join(lines)
-
-    def get_edge_indices(self, leaf_index):
+        return str(list(self))
+
+    def append(self, pair):
+        d, v = pair
+        self.depths.append(d)
+        self.values.append(v)
+
+    def pop(self):
+        return (self.depths.pop(), self.values.pop())
+
+    def search(self, d):
         """
-        Return the edge indices on the root-to-leaf path to the leaf at the
-        given leaf index.
+        Return (v, probes), where v is from the pair (d', v) such that d' is
+        the largest value that is less than or equal to d, and probes is the
+        number of d values compared against.
         """
-        first_index = 0 if leaf_index <= 1 else 1
-        second_index = 2 + 2 * first_index + (0 if leaf_index % 2 == 0 else 1)
-        return (first_index, second_index)
+        lo, hi = 0, len(self.depths)
+        probes = 0
+        while lo < hi:
+            mid = (lo + hi) // 2
+            probes += 1
+            if self.depths[mid] <= d:
+                lo = mid + 1
+            else:
+                hi = mid
+        assert(lo > 0)
+        return (self.values[lo - 1], probes)
+
+
+class SplitterTreeNode(object):
+    """
+    Non-leaf node of a SplitterTree. A node is never modified once created,
+    so unchanged subtrees are shared between copies of a tree. Children are
+    either nodes or leaf arrays.
+    """
+    def __init__(self, children, mid, d_values, symbol):
+        self.children = children  # (left, right)
+        self.mid = mid  # leaves with index < mid are in the left subtree
+        self.d_values = d_values  # (left edge, right edge), None = NIL
+        self.symbol = symbol  # How the node is displayed
 
-    def get_depth(self, leaf):
-        leaf_index = self.get_leaf_index(leaf)
-        edge_indices = self.get_edge_indices(leaf_index)
-        for i in range(len(edge_indices) - 1, - 1, -1):
-            if self.d_values[edge_indices[i]] != ' ':
-                return self.d_values[edge_indices[i]]
-        return None  # depth of NIL
 
-    def get_sibling_edge_index(self, edge_index):
+class SplitterTree(object):
+    def __init__(self, splitter_names=DEFAULT_SPLITTER_NAMES,
+                 symbol_assigner=None):
+        """
+        Holds the given splitters at the leaves of a balanced binary tree.
+        Path copies and root copies share all unchanged nodes with the tree
+        they are copied from, and the assigner of symbols for copied nodes.
+        """
+        if symbol_assigner is None:
+            symbol_assigner = SymbolAssigner()
+        self.symbol_assigner = symbol_assigner
+        if len(splitter_names) < 2:
+            raise ValueError("SplitterTree needs at least 2 splitters.")
+        self.splitter_names = tuple(splitter_names)
+        self.leaf_indices = {
+            name: i for i, name in enumerate(self.splitter_names)
+        }
+        # Number of nodes (leaves included) allocated to create this tree
+        self.allocated_nodes = 0
+        # Edges below the root start out NIL, root edges start at depth 0
+        self.root = self._build(0, len(self.splitter_names), 0)
+
+    def _build(self, lo, hi, d):
+        """Return a new subtree holding leaves lo to hi - 1."""
+        self.allocated_nodes += 1
+        if hi - lo == 1:
+            # depth of -1, same idea as depth of -infty
+            return LeafArray(-1, "init-{}".format(self.splitter_names[lo]))
+        mid = (lo + hi) // 2
+        children = (self._build(lo, mid, None), self._build(mid, hi, None))
+        return SplitterTreeNode(children, mid, (d, d), '.')
+
+    def __str__(self):
+        #   .
+        #   |-(0) .
+        #   | |-( ) W: [(-1, 'init-W')]
+        #   | `-( ) X: [(-1, 'init-X')]
+        #   `-(0) .
+        #     |-( ) Y: [(-1, 'init-Y')]
+        #     `-( ) Z: [(-1, 'init-Z')]
+        # d values of edges in parentheses, space = NIL
+        return '\n'.join(self._str_helper(self.root, 0))
+
+    def _str_helper(self, node, lo):
+        """Returns a list of strings that represent the subtree `node`."""
+        if isinstance(node, LeafArray):
+            return ["{}: {}".format(self.splitter_names[lo], node)]
+        lines = [node.symbol]
+        for i, child in enumerate(node.children):
+            d = node.d_values[i]
+            child_lines = self._str_helper(child, lo if i == 0 else node.mid)
+            child_lines[0] = "({}) {}".format(' ' if d is None else d,
+                                              child_lines[0])
+            if i == 0:
+                lines.append("|-{}".format(child_lines[0]))
+                lines.extend("| {}".format(line) for line in child_lines[1:])
+            else:
+                lines.append("`-{}".format(child_lines[0]))
+                lines.extend("  {}".format(line) for line in child_lines[1:])
+        return lines
+
+    def _with_root(self, root, allocated_nodes):
+        """Return a new SplitterTree with the same splitters and given root."""
+        new_splitter_tree = copy(self)
+        new_splitter_tree.root = root
+        new_splitter_tree.allocated_nodes = allocated_nodes
+        return new_splitter_tree
+
+    def get_path(self, leaf):
         """
-        Return the 'sibling' of the edge at the given index, i.e. the edge that
-        starts from the same parent but goes to a different child.
+        Return the list of (node, child index) pairs on the root-to-leaf path
+        to the given leaf.
         """
-        base = (edge_index // 2) * 2
-        return (2 * base + 1 - edge_index)
+        leaf_index = self.get_leaf_index(leaf)
+        path = []
+        node = self.root
+        while not isinstance(node, LeafArray):
+            i = 0 if leaf_index < node.mid else 1
+            path.append((node, i))
+            node = node.children[i]
+        return path
+
+    def get_depth(self, leaf):
+        """Return the d value of the lowest non-NIL edge above the leaf."""
+        depth = None  # depth of NIL
+        for node, i in self.get_path(leaf):
+            if node.d_values[i] is not None:
+                depth = node.d_values[i]
+        return depth
 
     def get_leaf_index(self, leaf):
-        if leaf not in self.splitter_names:
+        if leaf not in self.leaf_indices:
             raise InvalidActionError("Splitter {} does not exist.".format(leaf))
-        return self.splitter_names.index(leaf)
+        return self.leaf_indices[leaf]
 
     def get_leaf_array(self, leaf):
-        return self.leaf_arrays[self.get_leaf_index(leaf)]
+        node, i = self.get_path(leaf)[-1]
+        return node.children[i]
 
     def search_leaf(self, leaf, d):
         """
         Returns the value v from the pair (d', v) in the array corresponding to
         the leaf, such that d' is the largest value that is less than or equal
-        to d.
+        to d, together with the number of probes the search took.
         """
-        array = self.get_leaf_array(leaf)
-        # This "should" be a binary search, but who cares
-        last_v = None
-        for d_, v in array:
-            if d_ > d:
-                assert(last_v is not None)
-                return last_v
-            last_v = v
-        # Loop done, we want last element
-        return last_v
+        return self.get_leaf_array(leaf).search(d)
 
     def path_copy(self, leaf, value):
         """
-        leaf is one of the characters in self.splitter_names.
+        leaf is one of the names in self.splitter_names.
         Return a new SplitterTree, such that the depth of the specified leaf is
         NIL and the array at the specified leaf only contains (-1, value), and
-        the depth of all other leafs is unchanged.
+        the depth of all other leafs is unchanged. Only the nodes on the path
+        to the leaf are copied.
         """
-        leaf_index = self.get_leaf_index(leaf)
-        new_splitter_tree = SplitterTree()
-        # Set leaves
-        new_splitter_tree.leaf_arrays = copy(self.leaf_arrays)
-        new_splitter_tree.leaf_arrays[leaf_index] = [(-1, value)]
-        # Update edge weights
-        new_d_values = copy(self.d_values)
-        first_index, second_index = self.get_edge_indices(leaf_index)
-        # First level edge weight
-        latest_d = new_d_values[first_index]
-        new_d_values[first_index] = ' '
-        # Second level edge weight
-        sibling_index = self.get_sibling_edge_index(second_index)
-        if new_d_values[sibling_index] == ' ':
-            new_d_values[sibling_index] = latest_d
-        new_d_values[second_index] = ' '
-        new_splitter_tree.d_values = new_d_values
-        # New non-leaf node symbols
-        new_symbol = node_symbol_assigner.assign()
-        new_splitter_tree.node_symbols = copy(self.node_symbols)
-        new_splitter_tree.node_symbols[0] = new_symbol
-        if leaf in ('W', 'X'):
-            new_splitter_tree.node_symbols[1] = new_symbol
-        else:
-            new_splitter_tree.node_symbols[2] = new_symbol
-        return new_splitter_tree
+        path = self.get_path(leaf)
+        new_symbol = self.symbol_assigner.assign()
+        # Going down, NIL the edges on the path. The deepest d value seen so
+        # far is pushed onto the edge leaving the path, if that edge is NIL,
+        # so the depth of the leaves below it is unchanged.
+        new_d_values = []
+        latest_d = None
+        for node, i in path:
+            d_values = list(node.d_values)
+            if d_values[1 - i] is None:
+                d_values[1 - i] = latest_d
+            if d_values[i] is not None:
+                latest_d = d_values[i]
+            d_values[i] = None
+            new_d_values.append(tuple(d_values))
+        # Going up, copy the nodes on the path
+        new_node = LeafArray(-1, value)
+        for (node, i), d_values in zip(reversed(path), reversed(new_d_values)):
+            children = list(node.children)
+            children[i] = new_node
+            new_node = SplitterTreeNode(tuple(children), node.mid, d_values,
+                                        new_symbol)
+        return self._with_root(new_node, len(path) + 1)
 
     def root_copy(self, d):
         """
         Return a new SplitterTree, such that the depth of any leaf that was
         previously NIL is now d, any the depth of any leaf that was previously
-        not NIL is still not NIL.
+        not NIL is still not NIL. Only the root is copied.
         """
-        new_splitter_tree = SplitterTree()
-        # Set leaves
-        new_splitter_tree.leaf_arrays = self.leaf_arrays
-        # Set node symbols
-        new_splitter_tree.node_symbols = copy(self.node_symbols)
-        new_splitter_tree.node_symbols[0] = '.'  # Root copy root node no allocation
-        # Update weights at root
-        new_d_values = copy(self.d_values)
-        if new_d_values[0] == ' ':
-            new_d_values[0] = d
-        if new_d_values[1] == ' ':
-            new_d_values[1] = d
-        new_splitter_tree.d_values = new_d_values
-        # Update root node symbol
-        new_splitter_tree.node_symbols = copy(self.node_symbols)
-        new_splitter_tree.node_symbols[0] = '.'
-        return new_splitter_tree
+        root = self.root
+        new_d_values = tuple(d if d_ is None else d_ for d_ in root.d_values)
+        # Root copy root node no allocation
+        new_root = SplitterTreeNode(root.children, root.mid, new_d_values, '.')
+        return self._with_root(new_root, 1)
 
 
 class Frame(base.Frame):
-    def __init__(self,  frame_type):
-        super().__init__(frame_type)
+    def __init__(self, frame_type, id_assigner):
+        super().__init__(frame_type, id_assigner)
         self.record = None
         self.cache = None
         self.complex_alloc_group = None
+        # Spawn depth, kept up to date by attach/detach
+        self.depth = 1 if frame_type == "spawn" else 0
+
+    def attach(self, parent):
+        super().attach(parent)
+        self.depth = parent.depth + (1 if self.type == "spawn" else 0)
+
+    def detach(self):
+        super().detach()
+        self.depth = 1 if self.type == "spawn" else 0
 
     def get_depth(self):
         """
         Return the spawn depth of the frame.
         """
-        depth = 0
-        cur = self
-        if cur.type == "spawn":
-            depth += 1
-        while cur.parent is not None:
-            cur = cur.parent
-            if cur.type == "spawn":
-                depth += 1
-        return depth
+        return self.depth
+
+    def get_state(self):
+        state = super().get_state()
+        state["depth"] = self.depth
+        state["record"] = (None if self.record is None
+                           else self.record.get_state())
+        state["cache"] = None if self.cache is None else sorted(self.cache)
+        state["complex_alloc_group"] = (
+            None if self.complex_alloc_group is None
+            else list(self.complex_alloc_group))
+        return state
 
     def __str__(self):
         base_str = super().__str__()
@@ -1,16 +1,39 @@
 ###
-# You can run the interactive runtime system simulator with 
+# You can run the interactive runtime system simulator with
 #   python main.py
 #
 # You can also feed a number of instructions from a file into the simulator,
 # before entering the interactive part. For this, run
 #   python main.py file_with_newline_separated_commands.txt
+#
+# With --diff, only the parts of the state that changed are printed after each
+# action, with unchanged frame subtrees collapsed. Enter "full" to print the
+# full state.
+#
+# To run a trace without rendering or interaction, e.g. for long traces, run
+#   python main.py --headless file_with_newline_separated_commands.txt
+# The trace is read from stdin if no file (or "-") is given. State is only
+# printed with --print-every K (every K actions) or --print-final, and the
+# event counters and cost histograms of the run are dumped as JSON with
+# --stats. Views that leaked or are used after being destroyed are reported at
+# the end. The exit status is 1 if any action could not be parsed or
+# performed, 0 otherwise. The file may also be a binary trace (see
+# binary_trace.py).
+#
+# --mode fast skips invariant checks that cost O(size) per action and the
+# periodic checkpoints of the state, for long runs; --mode checked skips them
+# too, but verifies the whole state every --verify-every K actions instead
+# (see RTS.set_mode).
 ###
 
 
+import argparse
+import json
 import sys
 
+import binary_trace
 from helpers import color, ActionParseError, InvalidActionError
+from base_runtime_simulator import RUN_MODES, VERIFY_INTERVAL
 
 #from base_runtime_simulator import RTS, parse_action
 #from splitter_runtime_simulator import RTS, parse_action
@@ -33,21 +56,151 @@ def process_input(inp):
         print(color(">> Invalid action: {}\n\n".format(e), "red"))
         rts.restore()
 
-# Input file passed
-if len(sys.argv) > 1:
-    with open(sys.argv[1], "r") as f:
-        for line in f.readlines():
+
+def _with_str_keys(d):
+    """Return nested dict `d` with all keys converted to strings, for JSON."""
+    if not isinstance(d, dict):
+        return d
+    return {
+        ",".join(map(str, key)) if isinstance(key, tuple) else str(key):
+        _with_str_keys(val)
+        for key, val in d.items()
+    }
+
+
+def _check_supported(action, supported_types):
+    """
+    Raise ActionParseError if the type of an already parsed action, e.g. from
+    a binary trace, is not supported by the simulator.
+    """
+    if action.type not in supported_types:
+        parse_action(binary_trace.format_action(action))
+        supported_types.add(action.type)
+
+
+def run_headless(lines, print_every=None, print_final=False, stats=False):
+    """
+    Perform the actions in `lines` without rendering state in between, except
+    every `print_every` actions. Errors are reported with their line number.
+    `lines` may also contain already parsed actions, as read from a binary
+    trace. Return the number of lines that could not be parsed or performed.
+    """
+    num_actions = 0
+    num_parse_errors = 0
+    num_invalid = 0
+    supported_types = set()
+    for line_no, line in enumerate(lines, 1):
+        if not isinstance(line, str):
+            action = line
+            line = binary_trace.format_action(action)
+        else:
+            action = None
             line = line.strip()
+        if not line:
+            continue
+        num_actions += 1
+        try:
+            if action is None:
+                action = parse_action(line)
+            else:
+                _check_supported(action, supported_types)
+        except ActionParseError:
+            num_parse_errors += 1
+            print("line {}: unable to parse action: {}".format(line_no, line),
+                  file=sys.stderr)
+            continue
+        try:
+            rts.do_action(action)
+        except InvalidActionError as e:
+            num_invalid += 1
+            print("line {}: invalid action: {}: {}".format(line_no, line, e),
+                  file=sys.stderr)
+            rts.restore()
+        if print_every is not None and num_actions % print_every == 0:
+            print(color("After {} actions:\n".format(num_actions), "yellow"))
             print(rts.print_state())
-            print(color("> {}\n".format(line), "red"))
-            process_input(line)
-
-
-# Interactive
-while True:
-    print(rts.print_state())
-    print(color("> ", "red"), end="")
-    # User describes action, perform action
-    inp = input()
-    print("\n")
-    process_input(inp)
+    if print_final:
+        print(rts.print_state())
+    leaked, dangling = rts.check_views()
+    if leaked or dangling:
+        print("{} leaked views: {}; {} dangling views: {}".format(
+              len(leaked), leaked, len(dangling), dangling), file=sys.stderr)
+    if stats:
+        print(json.dumps({
+            "counters": rts.get_stats(),
+            "histograms": _with_str_keys(rts.get_histograms()),
+        }, indent=2))
+    print("{} actions: {} performed, {} unable to parse, {} invalid".format(
+          num_actions, num_actions - num_parse_errors - num_invalid,
+          num_parse_errors, num_invalid))
+    return num_parse_errors + num_invalid
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("file", nargs="?",
+                        help="file with newline separated commands")
+    parser.add_argument("--headless", action="store_true",
+                        help="run the commands without rendering or "
+                             "interaction")
+    parser.add_argument("--print-every", type=int, metavar="K",
+                        help="in headless mode, print state every K actions")
+    parser.add_argument("--print-final", action="store_true",
+                        help="in headless mode, print state at the end")
+    parser.add_argument("--stats", action="store_true",
+                        help="in headless mode, dump event counters and "
+                             "cost histograms at the end")
+    parser.add_argument("--diff", action="store_true",
+                        help="only print the changes to the state after each "
+                             "action")
+    parser.add_argument("--mode", choices=RUN_MODES, default="default",
+                        help="run mode, see RTS.set_mode")
+    parser.add_argument("--verify-every", type=int, default=VERIFY_INTERVAL,
+                        metavar="K",
+                        help="in checked mode, verify the state every K "
+                             "actions")
+    args = parser.parse_args()
+    rts.set_mode(args.mode, args.verify_every)
+
+    if args.headless:
+        if args.file is None or args.file == "-":
+            num_errors = run_headless(sys.stdin, args.print_every,
+                                      args.print_final, args.stats)
+        elif binary_trace.is_binary_trace(args.file):
+            num_errors = run_headless(binary_trace.read_trace(args.file),
+                                      args.print_every, args.print_final,
+                                      args.stats)
+        else:
+            with open(args.file, "r") as f:
+                num_errors = run_headless(f, args.print_every,
+                                          args.print_final, args.stats)
+        sys.exit(1 if num_errors else 0)
+
+    print_state = rts.print_state_changes if args.diff else rts.print_state
+
+    # Input file passed
+    if args.file is not None:
+        with open(args.file, "r") as f:
+            for line in f.readlines():
+                line = line.strip()
+                print(print_state())
+                print(color("> {}\n".format(line), "red"))
+                process_input(line)
+
+    # Interactive
+    state_str = print_state()
+    while True:
+        print(state_str)
+        print(color("> ", "red"), end="")
+        # User describes action, perform action
+        inp = input()
+        print("\n")
+        if inp.strip() == "full":
+            state_str = rts.print_state()
+            continue
+        process_input(inp)
+        state_str = print_state()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+#####
+#
+# Persistent (immutable) map, as a hash array mapped trie (HAMT). Setting a
+# key returns a new map, which shares all nodes with the old one except the
+# ones on the path to the key, so copying a map is free and an update costs
+# O(log n) in the number of keys.
+#
+# Each node has a bitmap of the 32 possible hash chunks (5 bits of the hash
+# per level) it has children for, and a tuple of children in chunk order. A
+# child is a leaf (one key), a node, or, when the full hashes of keys are
+# equal, a collision node.
+#
+#####
+
+
+BITS = 5
+MASK = (1 << BITS) - 1
+HASH_BITS = 64
+
+
+def _hash(key):
+    return hash(key) & ((1 << HASH_BITS) - 1)
+
+
+class _Leaf(object):
+    __slots__ = ("hash", "key", "value")
+
+    def __init__(self, hash_, key, value):
+        self.hash = hash_
+        self.key = key
+        self.value = value
+
+
+class _Collision(object):
+    """Leaves of keys with the same full hash."""
+    __slots__ = ("hash", "leaves")
+
+    def __init__(self, hash_, leaves):
+        self.hash = hash_
+        self.leaves = leaves  # tuple
+
+
+class _Node(object):
+    __slots__ = ("bitmap", "children")
+
+    def __init__(self, bitmap, children):
+        self.bitmap = bitmap
+        self.children = children  # tuple, in order of chunk
+
+    def index(self, bit):
+        """Return the index in children of the child for `bit`."""
+        return bin(self.bitmap & (bit - 1)).count("1")
+
+
+_EMPTY_NODE = _Node(0, ())
+
+
+def _get(node, hash_, key):
+    shift = 0
+    while True:
+        bit = 1 << ((hash_ >> shift) & MASK)
+        if not node.bitmap & bit:
+            return None
+        child = node.children[node.index(bit)]
+        if isinstance(child, _Node):
+            node = child
+            shift += BITS
+        elif isinstance(child, _Leaf):
+            return child if child.key == key else None
+        else:
+            for leaf in child.leaves:
+                if leaf.key == key:
+                    return leaf
+            return None
+
+
+def _merge(leaf1, leaf2, shift):
+    """Return a node holding two leaves (or collisions) of different keys."""
+    if shift >= HASH_BITS:
+        return _Collision(leaf1.hash, _leaves(leaf1) + _leaves(leaf2))
+    chunk1 = (leaf1.hash >> shift) & MASK
+    chunk2 = (leaf2.hash >> shift) & MASK
+    if chunk1 == chunk2:
+        return _Node(1 << chunk1, (_merge(leaf1, leaf2, shift + BITS),))
+    children = (leaf1, leaf2) if chunk1 < chunk2 else (leaf2, leaf1)
+    return _Node((1 << chunk1) | (1 << chunk2), children)
+
+
+def _leaves(child):
+    return child.leaves if isinstance(child, _Collision) else (child,)
+
+
+def _set(node, shift, leaf):
+    """
+    Return a copy of `node` with `leaf` set, and whether its key was added
+    (as opposed to replaced).
+    """
+    bit = 1 << ((leaf.hash >> shift) & MASK)
+    i = node.index(bit)
+    children = node.children
+    if not node.bitmap & bit:
+        return _Node(node.bitmap | bit,
+                     children[:i] + (leaf,) + children[i:]), True
+    child = children[i]
+    if isinstance(child, _Node):
+        new_child, added = _set(child, shift + BITS, leaf)
+    elif isinstance(child, _Leaf) and child.key == leaf.key:
+        new_child, added = leaf, False
+    elif child.hash == leaf.hash and isinstance(child, _Collision):
+        leaves = tuple(old for old in child.leaves if old.key != leaf.key)
+        added = len(leaves) == len(child.leaves)
+        new_child = _Collision(child.hash, leaves + (leaf,))
+    else:
+        new_child, added = _merge(child, leaf, shift + BITS), True
+    children = children[:i] + (new_child,) + children[i + 1:]
+    return _Node(node.bitmap, children), added
+
+
+def _iter_leaves(node):
+    for child in node.children:
+        if isinstance(child, _Node):
+            yield from _iter_leaves(child)
+        else:
+            yield from _leaves(child)
+
+
+class PersistentMap(object):
+    """
+    Immutable map. Reading works like a dict; set and update return a new
+    map.
+    """
+    __slots__ = ("root", "size")
+
+    def __init__(self, items=()):
+        self.root = _EMPTY_NODE
+        self.size = 0
+        for key, value in dict(items).items():
+            leaf = _Leaf(_hash(key), key, value)
+            self.root, added = _set(self.root, 0, leaf)
+            self.size += added
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, key):
+        return _get(self.root, _hash(key), key) is not None
+
+    def __getitem__(self, key):
+        leaf = _get(self.root, _hash(key), key)
+        if leaf is None:
+            raise KeyError(key)
+        return leaf.value
+
+    def get(self, key, default=None):
+        leaf = _get(self.root, _hash(key), key)
+        return default if leaf is None else leaf.value
+
+    def __iter__(self):
+        for leaf in _iter_leaves(self.root):
+            yield leaf.key
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return [leaf.value for leaf in _iter_leaves(self.root)]
+
+    def items(self):
+        return [(leaf.key, leaf.value) for leaf in _iter_leaves(self.root)]
+
+    def set(self, key, value):
+        """Return a map with `key` set to `value`."""
+        new = PersistentMap()
+        new.root, added = _set(self.root, 0, _Leaf(_hash(key), key, value))
+        new.size = self.size + added
+        return new
+
+    def update(self, items):
+        """Return a map with the (key, value) pairs of `items` set."""
+        new = self
+        for key, value in items:
+            new = new.set(key, value)
+        return new
+
+    def __copy__(self):
+        return self  # immutable
+
+    def __str__(self):
+        # Ordered by key, as the order of the trie depends on hashing
+        return "{{{}}}".format(", ".join(
+            "{!r}: {!r}".format(key, value)
+            for key, value in sorted(self.items(), key=lambda item: item[0])))
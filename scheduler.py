@@ -0,0 +1,134 @@
+#####
+#
+# Randomized work-stealing scheduler that drives a runtime system simulator.
+#
+# A program is described by tasks. A task is an iterable (a list, or e.g. a
+# generator) of instructions:
+#
+# ("spawn", task)   spawn a child that runs task
+# ("call", task)    call a child that runs task
+# ("sync",)         sync
+# ("work", n)       n units of computation, which take no step and are only
+#                   accounted for by the timing model (see timing_model.py)
+#
+# Any other instruction is performed by the executing worker as is, with the
+# worker id inserted, e.g. ("push", "x") becomes "push (worker id) x". After
+# its last instruction, a task syncs if it has outstanding children and then
+# returns.
+#
+# Example:
+#
+# def fib(n):
+#     if n >= 2:
+#         yield ("spawn", fib(n - 1))
+#         yield ("call", fib(n - 2))
+#         yield ("sync",)
+#
+# trace = Scheduler(fib(10), RTS(4), seed=1).run()
+#
+# Victims of steals are picked by a steal policy (see steal_policies.py),
+# uniformly random by default. The trace records the victim of each steal.
+#
+#####
+
+
+import random
+
+from helpers import InvalidActionError
+import base_runtime_simulator as base
+from steal_policies import RandomPolicy
+
+
+class Scheduler(object):
+    """
+    Runs a program on an RTS. Workers with work perform the next instruction
+    of their youngest frame, workers without work try to steal from a victim
+    chosen by the steal policy.
+    """
+    def __init__(self, program, rts, seed=None,
+                 parse_action=base.parse_action, steal_policy=None):
+        """
+        `program` is the task run by the initial frame of `rts`, and
+        `parse_action` is the parse function matching the RTS variant.
+        `steal_policy` becomes the steal policy of `rts`, a RandomPolicy
+        seeded with `seed` if None.
+        """
+        self.rts = rts
+        # Actions issued by the scheduler are always valid, so the RTS never
+        # needs to restore its state
+        self.rts.checkpoint_interval = None
+        self.parse_action = parse_action
+        self.random = random.Random(seed)
+        if steal_policy is None:
+            steal_policy = RandomPolicy(seed)
+        self.rts.steal_policy = steal_policy
+        self.tasks = {rts.initial_frame: iter(program)}  # frame -> task
+        self.done = False
+        self.trace = []  # actions performed, in order
+        self.num_steps = 0
+        self.num_steal_attempts = 0
+        self.num_failed_steals = 0
+
+    def do(self, worker, action_type, *args):
+        """Perform an action on the RTS and add it to the trace."""
+        line = " ".join((action_type, worker.id) + args)
+        self.rts.do_action(self.parse_action(line))
+        self.trace.append(line)
+
+    def work(self, worker, amount):
+        """Perform `amount` units of computation, which takes no time here."""
+        pass
+
+    def step(self, worker):
+        """Perform the next instruction of the worker's youngest frame."""
+        frame = worker.deque.youngest_frame
+        instruction = next(self.tasks[frame], None)
+        while instruction is not None and instruction[0] == "work":
+            self.work(worker, instruction[1])
+            instruction = next(self.tasks[frame], None)
+        if instruction is None:  # end of task
+            if len(frame.children) != 0:
+                # Implicit sync, which suspends the frame
+                assert(worker.deque.is_single_frame())
+                self.do(worker, "sync")
+            elif frame == self.rts.initial_frame:
+                self.done = True
+            else:
+                del self.tasks[frame]
+                self.do(worker, "return")
+        elif instruction[0] in ("spawn", "call"):
+            self.do(worker, instruction[0])
+            self.tasks[worker.deque.youngest_frame] = iter(instruction[1])
+        else:
+            self.do(worker, *instruction)
+
+    def try_steal(self, thief):
+        """Try to steal from the victim the steal policy picks."""
+        self.num_steal_attempts += 1
+        try:
+            # Steals are checked before they change any state, so a failed
+            # one needs no restore
+            self.rts.do_action(self.parse_action("steal " + thief.id))
+        except InvalidActionError:
+            self.num_failed_steals += 1
+            return
+        self.trace.append("steal {} {}".format(
+            thief.id, self.rts.actions[-1].victim_id))
+
+    def run(self):
+        """Run the program to completion, return the trace of actions."""
+        workers = list(self.rts.workers.values())
+        while not self.done:
+            if all(worker.deque.is_empty() for worker in workers):
+                raise RuntimeError("No worker has work, but the program has "
+                                   "not completed.")
+            self.random.shuffle(workers)
+            for worker in workers:
+                self.num_steps += 1
+                if not worker.deque.is_empty():
+                    self.step(worker)
+                elif len(workers) > 1:
+                    self.try_steal(worker)
+                if self.done:
+                    break
+        return self.trace
@@ -10,129 +10,224 @@
 #####
 
 
+from collections import deque
 from copy import copy
 
+from frame_store import FrameStore
 from helpers import (
-    color, frame_id_assigner, InvalidActionError, ActionParseError, Action
+    color, IDAssigner, InvalidActionError, InvariantError, ViewRegistry,
+    views_with_parents, deepcopy_chain
 )
 import base_runtime_simulator as base
 
 
-all_views = []
-
-
-def parse_action(s):
-    """Parse string s, return an Action object, including new splitter actions."""
-    try:  # see if s is a splitter action first
-        s_comp = s.split()
-        action_type = s_comp[0]
-        if action_type == "push":
-            action = Action(action_type, worker_id=s_comp[1],
-                            splitter_name=s_comp[2])
-        elif action_type == "set":
-            action = Action(action_type, worker_id=s_comp[1],
-                            splitter_name=s_comp[2], splitter_value=s_comp[3])
-        elif action_type == "pop":
-            action = Action(action_type, worker_id=s_comp[1],
-                            splitter_name=s_comp[2])
-        elif action_type == "access":
-            action = Action(action_type, worker_id=s_comp[1],
-                            splitter_name=s_comp[2])
-        else:
-            action = base.parse_action(s)
-        return action
-    except Exception:
-        raise ActionParseError()
+# Action types of the base simulator, and the splitter actions
+ACTIONS = base.ACTIONS.copy()
+
+
+@ACTIONS.register("push", ("worker_id", "splitter_name"))
+def _push(rts, action):
+    worker = rts.get_worker(action.worker_id)
+    worker.push(action.splitter_name)
+    worker.counters["splitter_push"] += 1
+
+
+@ACTIONS.register("set", ("worker_id", "splitter_name", "splitter_value"))
+def _set(rts, action):
+    worker = rts.get_worker(action.worker_id)
+    worker.set(action.splitter_name, action.splitter_value)
+    worker.counters["splitter_set"] += 1
+    # The view may be in hypermaps of other workers and frames
+    rts.touch(worker.cache[action.splitter_name])
+
+
+@ACTIONS.register("pop", ("worker_id", "splitter_name"))
+def _pop(rts, action):
+    worker = rts.get_worker(action.worker_id)
+    worker.pop(action.splitter_name)
+    worker.counters["splitter_pop"] += 1
+
+
+@ACTIONS.register("access", ("worker_id", "splitter_name"))
+def _access(rts, action):
+    worker = rts.get_worker(action.worker_id)
+    worker.access(action.splitter_name)
+    worker.counters["splitter_access"] += 1
+
+
+parse_action = ACTIONS.parse
 
 
 class RTS(base.RTS):
-    def __init__(self, num_workers):
-        frame_id_assigner.reset()
-        all_views.clear()
+    action_registry = ACTIONS
+
+    # Whether splitter lookups use an HMapIndex instead of walking the
+    # hypermap chain one parent at a time
+    indexed_lookup = False
+
+    def __init__(self, num_workers, compact_frames=False):
+        self.frame_id_assigner = IDAssigner()
+        self.frame_store = FrameStore(Frame) if compact_frames else None
+        self.view_registry = ViewRegistry()
+        self.lookup_index = HMapIndex() if self.indexed_lookup else None
         self.num_workers = num_workers
         # Initialize blank workers
         self.workers = {}
         for i in range(self.num_workers):
             worker_id = chr(65 + i)  # chr(65) = A
             # NOTE: override to use new Worker class
-            self.workers[worker_id] = Worker(worker_id)
+            self.workers[worker_id] = Worker(worker_id, self.frame_id_assigner,
+                                             self.view_registry,
+                                             self.frame_store,
+                                             self.lookup_index)
         # One worker starts with initial frame
-        self.initial_frame = Frame("initial")
+        self.initial_frame = self.workers['A'].new_frame("initial")
         init_worker = self.workers['A']
         self.initial_frame.worker = init_worker
         # That worker starts with a basic hypermap with default values
         initial_hmap = HMap(None)
-        x_init_view = View("init-x")
-        y_init_view = View("init-y")
+        x_init_view = View("init-x", self.view_registry)
+        y_init_view = View("init-y", self.view_registry)
         initial_hmap.top_map = {"x": x_init_view, "y": y_init_view}
         initial_hmap.base_map = {"x": x_init_view, "y": y_init_view}
         init_worker.deque.push(Stacklet(self.initial_frame))
         init_worker.hmap_deque.append(initial_hmap)
         # Keep track of all actions, for restoring
-        self.actions = []
-
-    def do_action(self, action):
-        if action.type == "push":
-            worker = self.get_worker(action.worker_id)
-            worker.push(action.splitter_name)
-            self.actions.append(action)
-        elif action.type == "set":
-            worker = self.get_worker(action.worker_id)
-            worker.set(action.splitter_name, action.splitter_value)
-            self.actions.append(action)
-        elif action.type == "pop":
-            worker = self.get_worker(action.worker_id)
-            worker.pop(action.splitter_name)
-            self.actions.append(action)
-        elif action.type == "access":
-            worker = self.get_worker(action.worker_id)
-            worker.access(action.splitter_name)
-            self.actions.append(action)
-        else:  # base action
-            super().do_action(action)
+        self._init_history()
+
+    def _print_global_state(self):
+        return (color("Views:\n\n", "yellow") + str(self.view_registry) +
+                "\n\n")
+
+    def _reachable_views(self):
+        """Return the views reachable from the hypermaps and caches."""
+        views = []
+        hmap_lists = [frame.hmaps for frame in self._iter_frames()]
+        caches = [frame.cache for frame in self._iter_frames()]
+        for worker in self.workers.values():
+            hmap_lists.extend(worker.hmap_deque)
+            caches.append(worker.cache)
+        for hmaps in hmap_lists:
+            for hmap in hmaps:
+                while hmap is not None:
+                    views.extend(hmap.top_map.values())
+                    views.extend(hmap.base_map.values())
+                    hmap = hmap.parent
+        for cache in caches:
+            if cache is not None:
+                views.extend(cache.values())
+        return views_with_parents(views)
+
+    def check_views(self):
+        return self.view_registry.find_leaks(self._reachable_views())
+
+    def verify(self):
+        """
+        Check the invariants of the base RTS, and that suspended frames hold
+        both their hypermaps and cache. View lifetimes are checked separately,
+        by check_views.
+        """
+        super().verify()
+        for frame in self._iter_frames():
+            if (frame.cache is None) != (frame.hmaps == []):
+                raise InvariantError("Frame {} holds only one of its "
+                                     "hypermaps and cache.".format(frame.id))
 
-    def print_state(self):
-        views_str = color("Views:\n\n", "yellow") + str(all_views) + "\n\n"
-        return views_str + super().print_state()
+    def get_stats(self):
+        stats = super().get_stats()
+        leaked, dangling = self.check_views()
+        stats["total"].update(self.view_registry.get_stats())
+        stats["total"]["leaked_views"] = len(leaked)
+        stats["total"]["dangling_views"] = len(dangling)
+        return stats
+
+
+class IndexedRTS(RTS):
+    indexed_lookup = True
 
 
 class Worker(base.Worker):
-    def __init__(self, id_):
-        super().__init__(id_)
+    def __init__(self, id_, frame_id_assigner, view_registry,
+                 frame_store=None, lookup_index=None):
+        super().__init__(id_, frame_id_assigner, frame_store)
+        self.frame_class = Frame
+        # Shared by the RTS
+        self.view_registry = view_registry
+        self.lookup_index = lookup_index
         # Keep track of splitter state
         self.hmap_deque = HMapDeque()
         self.cache = {}
 
+    def verify(self):
+        """
+        Check the invariants of the deque, and that each stacklet has a
+        nonempty list of hypermaps, each with the same splitters in its base
+        and top map.
+        """
+        super().verify()
+        if len(self.hmap_deque) != len(self.deque):
+            raise InvariantError("Worker {} has {} stacklets, but {} lists "
+                                 "of hypermaps.".format(
+                                     self.id, len(self.deque),
+                                     len(self.hmap_deque)))
+        for hmaps in self.hmap_deque:
+            if not hmaps:
+                raise InvariantError("Worker {} has a stacklet without "
+                                     "hypermaps.".format(self.id))
+            for hmap in hmaps:
+                if not hmap.is_consistent():
+                    raise InvariantError("Hypermap {} of worker {} has "
+                                         "different splitters in its base "
+                                         "and top map.".format(
+                                             dict(hmap.base_map), self.id))
+
     def access(self, splitter_name):
         if self.deque.is_empty():
             raise InvalidActionError("Cannot access splitter from empty worker.")
         if splitter_name in self.cache:
+            self.counters["access_hit"] += 1
             return self.cache[splitter_name]
         # start searching
         hmap_to_search = self.hmap_deque.oldest_hmaps[-1]
-        while splitter_name not in hmap_to_search:
-            hmap_to_search = hmap_to_search.parent
-            if hmap_to_search is None:
-                raise InvalidActionError("Splitter {} not found".format(
-                                         splitter_name))
+        if self.lookup_index is None:
+            hmap_to_search, hops = find_defining_hmap(hmap_to_search,
+                                                      splitter_name)
+        else:
+            hmap_to_search, hops = self.lookup_index.find(hmap_to_search,
+                                                          splitter_name)
+        if hmap_to_search is None:
+            raise InvalidActionError("Splitter {} not found".format(
+                                     splitter_name))
         view = hmap_to_search.top_map[splitter_name]
         self.cache[splitter_name] = view
+        # Cost of the search, in hypermap links followed
+        self.counters["access_miss"] += 1
+        self.counters["search_hops"] += hops
+        self.histograms["search_hops"][hops] += 1
         return view
 
     def push(self, splitter_name):
         parent_view = self.access(splitter_name)
-        new_view = View(parent_view.value)
+        new_view = View(parent_view.value, self.view_registry)
         new_view.parent = parent_view
         hmap = self.hmap_deque.youngest_hmap
         if splitter_name not in hmap:
-            hmap.base_map[splitter_name] = parent_view
-        hmap.top_map[splitter_name] = new_view
+            self._define(hmap, splitter_name, parent_view, new_view)
+        else:
+            hmap.top_map[splitter_name] = new_view
         oldest_of_youngest = self.hmap_deque.oldest_of_youngest
         if splitter_name not in oldest_of_youngest:
-            oldest_of_youngest.base_map[splitter] = parent_view
-            oldest_of_youngest.top_map[splitter] = parent_view
+            self._define(oldest_of_youngest, splitter_name, parent_view,
+                         parent_view)
         self.cache[splitter_name] = new_view
 
+    def _define(self, hmap, splitter_name, base_view, top_view):
+        """Add a splitter to `hmap`, which changes where lookups find it."""
+        hmap.base_map[splitter_name] = base_view
+        hmap.top_map[splitter_name] = top_view
+        if self.lookup_index is not None:
+            self.lookup_index.invalidate(hmap, splitter_name)
+
     def set(self, splitter_name, splitter_value):
         view = self.access(splitter_name)
         view.value = splitter_value
@@ -162,13 +257,13 @@ class Worker(base.Worker):
     def call(self):
         """Call, add a new frame on current stacklet."""
         self.check_call_valid()
-        new_frame = Frame("call")
+        new_frame = self.new_frame("call")
         new_frame.worker = self
         self.deque.youngest_stacklet.push(new_frame)
 
     def spawn(self):
         self.check_spawn_valid()
-        new_frame = Frame("spawn")
+        new_frame = self.new_frame("spawn")
         new_frame.worker = self
         new_frame.attach(self.deque.youngest_frame)
         new_stacklet = Stacklet(new_frame)
@@ -188,13 +283,15 @@ class Worker(base.Worker):
             raise InvalidActionError("Cannot return without having popped "
                                      "all pushed splitters.")
         self.hmap_deque.pop()
+        youngest_hmap.drop()
         if self.deque.is_single_frame():
             self.cache = {}
         super().ret_from_spawn()
 
     def steal(self, victim):
         super().steal(victim)
-        stolen_hmaps = victim.hmap_deque.pop(0)
+        stolen_hmaps = victim.hmap_deque.pop_head()
+        assert(len(victim.deque) == len(victim.hmap_deque))
         assert(len(self.hmap_deque) == 0)
         self.hmap_deque.deque.append(stolen_hmaps)
         new_hmap = HMap(self.hmap_deque.youngest_hmap)
@@ -213,6 +310,8 @@ class Worker(base.Worker):
             assert(cur_frame.cache is None and cur_frame.hmaps == [])
             cur_frame.hmaps = self.hmap_deque.pop()
             assert(len(self.hmap_deque) == 0)
+            if self.check_invariants:
+                assert(all(hmap.is_consistent() for hmap in cur_frame.hmaps))
             cur_frame.cache = self.cache
             self.cache = {}
             self.provably_good_steal(cur_frame)
@@ -225,26 +324,50 @@ class Worker(base.Worker):
         # merge hypermaps
         hmaps = frame.hmaps
         frame.hmaps = []
+        self.counters["hmaps_merged"] += len(hmaps) - 1
         accum = hmaps[0]
-        for i in range(1, len(hmaps)):
-            child = hmaps[i]
-            for splitter_name in child:
-                top_view = accum.top_map[splitter_name]
-                base_view = child.base_map[splitter_name]
-                # Destroy from top to base, not including base
-                iter_view = top_view
+        top_map = accum.top_map
+        num_merged = 0  # splitter entries of the children merged into accum
+        dropped = []  # views replaced by the children's, destroyed at the end
+        for child in hmaps[1:]:
+            base_map = child.base_map
+            for splitter_name, child_top_view in child.top_map.items():
+                # Drop from top to base, not including base
+                base_view = base_map[splitter_name]
+                iter_view = top_map[splitter_name]
                 while iter_view is not base_view:
-                    print(iter_view)
-                    iter_view.destroy()
+                    dropped.append(iter_view)
                     iter_view = iter_view.parent
                 # Update top view
-                accum.top_map[splitter_name] = child.top_map[splitter_name]
+                top_map[splitter_name] = child_top_view
+            num_merged += len(base_map)
+            child.drop()
+        self.view_registry.destroy_all(dropped)
+        self.counters["splitters_merged"] += num_merged
+        self.counters["views_destroyed_by_merge"] += len(dropped)
+        self.histograms["splitters_merged"][num_merged] += 1
+        self.histograms["views_destroyed_by_merge"][len(dropped)] += 1
         self.hmap_deque.append(accum)
 
+    def get_state(self):
+        """
+        Return the state of the worker as plain data, with the hypermaps of
+        each stacklet (see HMap.get_state) and the cache.
+        """
+        state = super().get_state()
+        state["hmaps"] = [
+            [hmap.get_state() for hmap in hmaps] for hmaps in self.hmap_deque
+        ]
+        state["cache"] = cache_state(self.cache)
+        return state
+
     def print_state(self):
         # interleave call stack and hypermaps
         # under each call stack, print hypermaps in order of oldest to youngest
         assert(len(self.deque) == len(self.hmap_deque))
+        if self.check_invariants:
+            assert(all(hmap.is_consistent()
+                       for hmaps in self.hmap_deque for hmap in hmaps))
         str_comp = []
         for i, (stacklet, hmaps) in enumerate(zip(self.deque, self.hmap_deque)):
             pos_comp = []
@@ -264,12 +387,23 @@ class Worker(base.Worker):
         str_comp.append("\n")
         return "".join(str_comp)
 
+    def shown_objects(self):
+        """Return the views in the hypermaps and cache, see print_state."""
+        return shown_views(
+            [hmap for hmaps in self.hmap_deque for hmap in hmaps], self.cache)
+
 
 class HMap(object):
     def __init__(self, parent):
         self.top_map = {}
         self.base_map = {}
         self.parent = parent
+        # Number of hmaps in use with this one as parent, see HMapIndex
+        self.num_children = 0
+        if parent is not None:
+            parent.num_children += 1
+        # Splitter name -> (version, nearest hmap defining it), see HMapIndex
+        self.nearest = {}
 
     def __contains__(self, key):
         return key in self.base_map
@@ -277,27 +411,105 @@ class HMap(object):
     def __iter__(self):
         yield from self.base_map.keys()
 
+    def __deepcopy__(self, memo):
+        return deepcopy_chain(self, memo)
+
+    def drop(self):
+        """Called when the hmap is no longer used, e.g. merged into another."""
+        if self.parent is not None:
+            self.parent.num_children -= 1
+
+    def is_consistent(self):
+        """Return whether the base and top map have the same splitters."""
+        return self.base_map.keys() == self.top_map.keys()
+
     def __str__(self):
-        assert(self.base_map.keys() == self.top_map.keys())
         str_comp = []
         for splitter_name in self.base_map:
             str_comp.append(splitter_name)
             str_comp.append(": ")
-            base_view = self.base_map[splitter_name]
-            iter_view = self.top_map[splitter_name]
-            values = []
-            while iter_view is not base_view:
-                values.append(iter_view.value)
-                iter_view = iter_view.parent
-            values.append(iter_view.value)
-            values.reverse()  # oldest in front, youngest at end
-            str_comp.append("<-".join(values))
+            str_comp.append("<-".join(self.get_values(splitter_name)))
             str_comp.append("; ")
         return "".join(str_comp)
 
+    def get_values(self, splitter_name):
+        """
+        Return the values of the views of a splitter from base to top, oldest
+        in front, youngest at end.
+        """
+        return [view.value for view in self.get_views(splitter_name)]
+
+    def get_views(self, splitter_name):
+        """Return the views of a splitter from base to top."""
+        base_view = self.base_map[splitter_name]
+        iter_view = self.top_map[splitter_name]
+        views = []
+        while iter_view is not base_view:
+            views.append(iter_view)
+            iter_view = iter_view.parent
+        views.append(iter_view)
+        views.reverse()
+        return views
+
+    def get_state(self):
+        """Return the hmap as a dict of splitter name -> view values."""
+        return {name: self.get_values(name) for name in self.base_map}
+
+def find_defining_hmap(hmap, splitter_name):
+    """
+    Return the nearest hmap defining the splitter on the parent chain starting
+    at `hmap` (None if there is none), and the number of parent links
+    followed.
+    """
+    hops = 0
+    while hmap is not None and splitter_name not in hmap:
+        hmap = hmap.parent
+        hops += 1
+    return hmap, hops
+
+
+class HMapIndex(object):
+    """
+    Memoizes, in each hmap searched from, the nearest hmap on its parent
+    chain that defines a splitter. Searches jump along memoized entries, and
+    memoize their result in every hmap they pass (path compression).
+
+    Parent chains never change and splitters are never removed from an hmap,
+    so a memoized entry only goes stale when the splitter is added to an hmap
+    that the entry skips, which is then an ancestor of the hmap holding the
+    entry. Splitters are mostly added to the youngest hmap of a worker, which
+    has no children, so that nothing is invalidated. Otherwise, the version
+    of the splitter is bumped, which invalidates all its entries.
+    """
+    def __init__(self):
+        self.versions = {}  # splitter name -> version
+
+    def invalidate(self, hmap, splitter_name):
+        """Called when the splitter is added to `hmap`."""
+        if hmap.num_children > 0:
+            self.versions[splitter_name] = (
+                self.versions.get(splitter_name, 0) + 1)
+
+    def find(self, hmap, splitter_name):
+        """Same as find_defining_hmap, where a jump counts as one link."""
+        version = self.versions.get(splitter_name, 0)
+        passed = []
+        while hmap is not None and splitter_name not in hmap:
+            passed.append(hmap)
+            memoized = hmap.nearest.get(splitter_name)
+            if memoized is not None and memoized[0] == version:
+                hmap = memoized[1]
+            else:
+                hmap = hmap.parent
+        for passed_hmap in passed:
+            passed_hmap.nearest[splitter_name] = (version, hmap)
+        return hmap, len(passed)
+
+
 class HMapDeque(object):
     def __init__(self):
-        self.deque = []  # each entry is a list from oldest to youngest in order
+        # each entry is a list from oldest to youngest in order
+        self.deque = deque()
 
     def __len__(self):
         return len(self.deque)
@@ -324,14 +536,21 @@ class HMapDeque(object):
     def append(self, hmap):
         self.deque.append([hmap])
 
-    def pop(self, index=-1):
-        return self.deque.pop(index)
+    def pop(self):
+        return self.deque.pop()
+
+    def pop_head(self):
+        return self.deque.popleft()
 
 class View(object):
-    def __init__(self, value):
+    def __init__(self, value, view_registry):
         self.value = value
         self.parent = None
-        all_views.append(self)
+        self.view_registry = view_registry  # of the RTS the view belongs to
+        self.view_registry.allocate(self)
+
+    def __deepcopy__(self, memo):
+        return deepcopy_chain(self, memo)
 
     def __str__(self):
         return str(self.value)
@@ -340,8 +559,7 @@ class View(object):
         return str(self.value)
 
     def destroy(self):
-        assert(self in all_views)
-        all_views.remove(self)
+        self.view_registry.destroy(self)
 
 
 class Stacklet(base.Stacklet):
@@ -349,12 +567,12 @@ class Stacklet(base.Stacklet):
 
 
 class Frame(base.Frame):
-    def __init__(self, frame_type):
+    def __init__(self, frame_type, id_assigner):
         """
         Suspended frames may need to keep track of the state by keeping track
         of hmaps and cache.
         """
-        super().__init__(frame_type)
+        super().__init__(frame_type, id_assigner)
         self.hmaps = []
         self.cache = None
 
@@ -373,3 +591,31 @@ class Frame(base.Frame):
         str_comp.append("Cache: ")
         str_comp.append(str(self.cache))
         return "".join(str_comp)
+
+    def shown_objects(self):
+        """Return the views in the hypermaps and cache, see __str__."""
+        return shown_views(self.hmaps, self.cache)
+
+    def get_state(self):
+        state = super().get_state()
+        state["hmaps"] = [hmap.get_state() for hmap in self.hmaps]
+        state["cache"] = cache_state(self.cache)
+        return state
+
+
+def shown_views(hmaps, cache):
+    """Return the views of all splitters in `hmaps`, and the ones in `cache`."""
+    views = [
+        view for hmap in hmaps for splitter_name in hmap.base_map
+        for view in hmap.get_views(splitter_name)
+    ]
+    if cache is not None:
+        views.extend(cache.values())
+    return views
+
+
+def cache_state(cache):
+    """Return a cache as a dict of splitter name -> view value."""
+    if cache is None:
+        return None
+    return {name: view.value for name, view in sorted(cache.items())}
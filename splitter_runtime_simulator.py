@@ -6,83 +6,143 @@
 # set (worker id) (splitter name) (splitter value)
 # pop (worker id) (splitter name)
 #
+# The ancestor and active hypermaps of workers and frames are persistent maps
+# (see persistent_map.py), so that a thief shares them with its victim.
+#
 #####
 
 
-from copy import copy
+from collections import deque
 
+from frame_store import FrameStore
 from helpers import (
-    color, frame_id_assigner, InvalidActionError, ActionParseError, Action
+    color, IDAssigner, InvalidActionError, InvariantError, ViewRegistry,
+    views_with_parents, deepcopy_chain
 )
+from persistent_map import PersistentMap
 import base_runtime_simulator as base
 
 
-def parse_action(s):
-    """Parse string s, return an Action object, including new splitter actions."""
-    try:  # see if s is a splitter action first
-        s_comp = s.split()
-        action_type = s_comp[0]
-        if action_type == "push":
-            action = Action(action_type, worker_id=s_comp[1],
-                            splitter_name=s_comp[2])
-        elif action_type == "set":
-            action = Action(action_type, worker_id=s_comp[1],
-                            splitter_name=s_comp[2], splitter_value=s_comp[3])
-        elif action_type == "pop":
-            action = Action(action_type, worker_id=s_comp[1],
-                            splitter_name=s_comp[2])
-        else:
-            action = base.parse_action(s)
-        return action
-    except Exception:
-        raise ActionParseError()
+# Action types of the base simulator, and the splitter actions
+ACTIONS = base.ACTIONS.copy()
+
+
+@ACTIONS.register("push", ("worker_id", "splitter_name"))
+def _push(rts, action):
+    worker = rts.get_worker(action.worker_id)
+    worker.push(action.splitter_name)
+    worker.counters["splitter_push"] += 1
+
+
+@ACTIONS.register("set", ("worker_id", "splitter_name", "splitter_value"))
+def _set(rts, action):
+    worker = rts.get_worker(action.worker_id)
+    worker.set(action.splitter_name, action.splitter_value)
+    worker.counters["splitter_set"] += 1
+    # The view may be shared with other workers and frames
+    rts.touch(worker.active_hmap[action.splitter_name])
+
+
+@ACTIONS.register("pop", ("worker_id", "splitter_name"))
+def _pop(rts, action):
+    worker = rts.get_worker(action.worker_id)
+    worker.pop(action.splitter_name)
+    worker.counters["splitter_pop"] += 1
+
+
+parse_action = ACTIONS.parse
 
 
 class RTS(base.RTS):
-    def __init__(self, num_workers):
-        frame_id_assigner.reset()
+    action_registry = ACTIONS
+
+    def __init__(self, num_workers, compact_frames=False):
+        self.frame_id_assigner = IDAssigner()
+        self.view_registry = ViewRegistry()
+        # With compact_frames, frames are kept in a FrameStore instead of as
+        # separate objects, for simulations with many live frames
+        self.frame_store = FrameStore(Frame) if compact_frames else None
         self.num_workers = num_workers
         # Initialize blank workers
         self.workers = {}
         for i in range(self.num_workers):
             worker_id = chr(65 + i)  # chr(65) = A
             # NOTE: override to use new Worker class
-            self.workers[worker_id] = Worker(worker_id)
+            self.workers[worker_id] = Worker(worker_id, self.frame_id_assigner,
+                                             self.view_registry,
+                                             self.frame_store)
         # One worker starts with initial frame
-        self.initial_frame = Frame("initial")
+        self.initial_frame = self.workers['A'].new_frame("initial")
         init_worker = self.workers['A']
         init_worker.deque.push(Stacklet(self.initial_frame))
         self.initial_frame.worker = init_worker
         init_worker.aug_hmap_deque.append(AugmentedHmap())
-        init_worker.ancestor_hmap = copy(initial_hmap)
-        init_worker.active_hmap = copy(initial_hmap)
+        # Views of this RTS only, so that RTS instances do not share state
+        initial_hmap = PersistentMap({
+            "x": View("init-val", self.view_registry),
+            "y": View("init-val", self.view_registry),
+        })
+        init_worker.ancestor_hmap = initial_hmap
+        init_worker.active_hmap = initial_hmap
         # Keep track of all actions, for restoring
-        self.actions = []
-
-    def do_action(self, action):
-        if action.type == "push":
-            worker = self.get_worker(action.worker_id)
-            worker.push(action.splitter_name)
-            self.actions.append(action)
-        elif action.type == "set":
-            worker = self.get_worker(action.worker_id)
-            worker.set(action.splitter_name, action.splitter_value)
-            self.actions.append(action)
-        elif action.type == "pop":
-            worker = self.get_worker(action.worker_id)
-            worker.pop(action.splitter_name)
-            self.actions.append(action)
-        else:  # base action
-            super().do_action(action)
+        self._init_history()
+
+    def _reachable_views(self):
+        """Return the views reachable from the hypermaps of workers and frames."""
+        hmaps = []
+        owners = list(self.workers.values()) + list(self._iter_frames())
+        for owner in owners:
+            hmaps.extend((owner.ancestor_hmap, owner.active_hmap))
+        aug_hmaps = [frame.aug_hmap for frame in self._iter_frames()]
+        for worker in self.workers.values():
+            aug_hmaps.extend(worker.aug_hmap_deque)
+        for aug_hmap in aug_hmaps:
+            if aug_hmap is not None:
+                hmaps.extend((aug_hmap.cur_map, aug_hmap.start_map))
+        return views_with_parents(
+            view for hmap in hmaps if hmap is not None
+            for view in hmap.values()
+        )
+
+    def check_views(self):
+        return self.view_registry.find_leaks(self._reachable_views())
+
+    def verify(self):
+        """
+        Check the invariants of the base RTS, and that suspended frames hold
+        all of their hypermaps or none. View lifetimes are checked separately,
+        by check_views.
+        """
+        super().verify()
+        for frame in self._iter_frames():
+            hmaps = (frame.ancestor_hmap, frame.aug_hmap, frame.active_hmap)
+            if any(hmap is None for hmap in hmaps) != all(
+                    hmap is None for hmap in hmaps):
+                raise InvariantError("Frame {} holds only some of its "
+                                     "hypermaps.".format(frame.id))
+
+    def get_stats(self):
+        stats = super().get_stats()
+        leaked, dangling = self.check_views()
+        stats["total"].update(self.view_registry.get_stats())
+        stats["total"]["leaked_views"] = len(leaked)
+        stats["total"]["dangling_views"] = len(dangling)
+        return stats
 
 
 class Worker(base.Worker):
-    def __init__(self, id_):
-        super().__init__(id_)
+    def __init__(self, id_, frame_id_assigner, view_registry,
+                 frame_store=None):
+        super().__init__(id_, frame_id_assigner, frame_store)
+        self.frame_class = Frame
+        self.view_registry = view_registry  # shared by the RTS
         # Keep track of splitter state
-        self.aug_hmap_deque = []
+        self.aug_hmap_deque = deque()
         self.ancestor_hmap = None
         self.active_hmap = None
+        # Views the ancestor hypermap holds a reference to (see steal), which
+        # are released when it is dropped
+        self.ancestor_views = []
 
     @property
     def oldest_aug_hmap(self):
@@ -102,12 +162,38 @@ class Worker(base.Worker):
             raise InvalidActionError("Splitter {} not found".format(
                                      splitter_name))
 
+    def verify(self):
+        """
+        Check the invariants of the deque, and that there is an augmented
+        hypermap per stacklet, and ancestor and active hypermaps if and only if
+        the deque is not empty.
+        """
+        super().verify()
+        if len(self.aug_hmap_deque) != len(self.deque):
+            raise InvariantError("Worker {} has {} stacklets, but {} augmented "
+                                 "hypermaps.".format(
+                                     self.id, len(self.deque),
+                                     len(self.aug_hmap_deque)))
+        for aug_hmap in self.aug_hmap_deque:
+            if not aug_hmap.is_consistent():
+                raise InvariantError("Augmented hypermap {} of worker {} is "
+                                     "inconsistent.".format(aug_hmap, self.id))
+        has_hmaps = (self.ancestor_hmap is not None and
+                     self.active_hmap is not None)
+        if has_hmaps == self.deque.is_empty():
+            raise InvariantError("Worker {} has ancestor and active hypermaps "
+                                 "if and only if its deque is "
+                                 "empty.".format(self.id))
+
     def push(self, splitter_name):
         self._check_splitter_action_valid(splitter_name)
+        if self.check_invariants:
+            assert(self.youngest_aug_hmap.is_consistent())
         prev_active_view = self.active_hmap[splitter_name]
-        new_view = View(prev_active_view.value)
+        new_view = View(prev_active_view.value, self.view_registry)
         new_view.parent = prev_active_view
-        self.active_hmap[splitter_name] = new_view
+        prev_active_view.count += 1  # referenced by its child
+        self.active_hmap = self.active_hmap.set(splitter_name, new_view)
         self.youngest_aug_hmap.push(splitter_name, new_view)
 
     def set(self, splitter_name, splitter_value):
@@ -116,23 +202,46 @@ class Worker(base.Worker):
 
     def pop(self, splitter_name):
         self._check_splitter_action_valid(splitter_name)
-        self.active_hmap[splitter_name].count -= 1
+        if self.check_invariants:
+            assert(self.youngest_aug_hmap.is_consistent())
+        view = self.active_hmap[splitter_name]
         self.youngest_aug_hmap.pop(splitter_name)
-        self.active_hmap[splitter_name] = self.active_hmap[splitter_name].parent
+        self.active_hmap = self.active_hmap.set(splitter_name, view.parent)
+        self._release_views([view])
+
+    def _release_views(self, views):
+        """
+        Drop a reference to each of `views`. Views that are no longer
+        referenced are destroyed, which drops their reference to their parent.
+        """
+        for view in views:
+            view.count -= 1
+            while view.count == 0:
+                self.view_registry.destroy(view)
+                view = view.parent
+                if view is None:
+                    break
+                view.count -= 1
 
     def steal(self, victim):
         self.check_steal_valid(victim)
-        # Construct new ancestor hypermap for victim
-        thief_ancestor_hmap = copy(victim.ancestor_hmap)
-        victim_ancestor_hmap = victim.ancestor_hmap
-        for name, view in victim.oldest_aug_hmap.cur_map.items():
-            victim_ancestor_hmap[name] = view
-        # Set hypermaps
-        self.ancestor_hmap = thief_ancestor_hmap
-        self.active_hmap = copy(victim_ancestor_hmap)
-        aug_hmap = victim.aug_hmap_deque.pop(0)
+        # The thief takes over the victim's ancestor hypermap, and the victim
+        # gets a new one with the splitters pushed in the stolen stacklet.
+        # Both share all other entries, so this only costs the pushed ones.
+        self.ancestor_hmap = victim.ancestor_hmap
+        self.ancestor_views = victim.ancestor_views
+        shared = victim.oldest_aug_hmap.cur_map
+        victim.ancestor_hmap = victim.ancestor_hmap.update(shared.items())
+        # The pushed views stay alive while the victim works below them,
+        # even if the thief pops them
+        victim.ancestor_views = list(shared.values())
+        for view in victim.ancestor_views:
+            view.count += 1
+        self.active_hmap = victim.ancestor_hmap
+        aug_hmap = victim.aug_hmap_deque.popleft()
         self.aug_hmap_deque.append(aug_hmap)
         super().steal(victim)
+        assert(len(victim.deque) == len(victim.aug_hmap_deque))
 
     def sync(self):
         self.check_sync_valid()
@@ -146,15 +255,19 @@ class Worker(base.Worker):
             assert(cur_frame.ancestor_hmap is None and cur_frame.aug_hmap is None)
             cur_frame.aug_hmap = self.aug_hmap_deque.pop()
             assert(len(self.aug_hmap_deque) == 0)
+            if self.check_invariants:
+                assert(cur_frame.aug_hmap.is_consistent())
             cur_frame.ancestor_hmap = self.ancestor_hmap
             self.ancestor_hmap = None
+            cur_frame.ancestor_views = self.ancestor_views
+            self.ancestor_views = []
             cur_frame.active_hmap = self.active_hmap
             self.active_hmap = None
             self.provably_good_steal(cur_frame)
 
     def spawn(self):
         self.check_spawn_valid()
-        new_frame = Frame("spawn")
+        new_frame = self.new_frame("spawn")
         new_frame.worker = self
         new_frame.attach(self.deque.youngest_frame)
         new_stacklet = Stacklet(new_frame)
@@ -163,11 +276,13 @@ class Worker(base.Worker):
 
     def call(self):
         self.check_call_valid()
-        new_frame = Frame("call")
+        new_frame = self.new_frame("call")
         new_frame.worker = self
         self.deque.youngest_stacklet.push(new_frame)
 
     def ret_from_spawn(self):
+        if self.check_invariants:
+            assert(self.youngest_aug_hmap.is_consistent())
         if len(self.youngest_aug_hmap) != 0:
             raise InvalidActionError("Cannot return without having popped "
                                      "all pushed splitters.")
@@ -175,8 +290,9 @@ class Worker(base.Worker):
         if self.deque.is_single_frame():
             self.active_hmap = None
             self.ancestor_hmap = None
+            self._release_views(self.ancestor_views)
+            self.ancestor_views = []
         super().ret_from_spawn()
-        # TODO: correctly simulate "destroy view" since python garbage collects
 
     def provably_good_steal_success(self, frame):
         super().provably_good_steal_success(frame)
@@ -184,12 +300,30 @@ class Worker(base.Worker):
         # Change ownership of hypermaps
         self.ancestor_hmap = frame.ancestor_hmap
         frame.ancestor_hmap = None
+        self.ancestor_views = frame.ancestor_views
+        frame.ancestor_views = []
         self.aug_hmap_deque.append(frame.aug_hmap)
         frame.aug_hmap = None
         self.active_hmap = frame.active_hmap
         frame.active_hmap = None
 
+    def get_state(self):
+        """
+        Return the state of the worker as plain data, with its hypermaps as
+        dicts of splitter name -> view value.
+        """
+        state = super().get_state()
+        state["ancestor_hmap"] = hmap_state(self.ancestor_hmap)
+        state["active_hmap"] = hmap_state(self.active_hmap)
+        state["aug_hmaps"] = [
+            aug_hmap.get_state() for aug_hmap in self.aug_hmap_deque
+        ]
+        return state
+
     def print_state(self):
+        if self.check_invariants:
+            assert(all(aug_hmap.is_consistent()
+                       for aug_hmap in self.aug_hmap_deque))
         base_str = super().print_state()
         str_comp = []
         str_comp.append(base_str)
@@ -207,6 +341,12 @@ class Worker(base.Worker):
         str_comp.append("\n")
         return "".join(str_comp)
 
+    def shown_objects(self):
+        """Return the views in the hypermaps of the worker, see print_state."""
+        hmaps = [self.ancestor_hmap, self.active_hmap]
+        hmaps.extend(aug_hmap.cur_map for aug_hmap in self.aug_hmap_deque)
+        return hmap_views(hmaps)
+
 
 class AugmentedHmap(object):
     def __init__(self):
@@ -214,12 +354,14 @@ class AugmentedHmap(object):
         self.start_map = {}
 
     def __len__(self):
-        assert(self.cur_map.keys() == self.start_map.keys())
         return len(self.cur_map)
 
+    def is_consistent(self):
+        """Return whether the current and start map have the same splitters."""
+        return self.cur_map.keys() == self.start_map.keys()
+
     def push(self, splitter_name, view):
         """Push view into hypermap at deque position."""
-        assert(self.cur_map.keys() == self.start_map.keys())
         if splitter_name in self.cur_map:
             self.cur_map[splitter_name] = view
         else:
@@ -227,7 +369,6 @@ class AugmentedHmap(object):
             self.start_map[splitter_name] = view
 
     def pop(self, splitter_name):
-        assert(self.cur_map.keys() == self.start_map.keys())
         if splitter_name not in self.cur_map:
             raise InvalidActionError("Cannot pop splitter {}".format(
                                      splitter_name))
@@ -240,15 +381,37 @@ class AugmentedHmap(object):
             self.cur_map[splitter_name] = popped_view.parent
 
     def __str__(self):
-        assert(self.cur_map.keys() == self.start_map.keys())
         return str(self.cur_map)
 
+    def get_state(self):
+        return {"cur": hmap_state(self.cur_map),
+                "start": hmap_state(self.start_map)}
+
+
+def hmap_views(hmaps):
+    """Return the views in `hmaps`, skipping the ones that are None."""
+    return tuple(
+        view for hmap in hmaps if hmap is not None for view in hmap.values())
+
+
+def hmap_state(hmap):
+    """Return a hypermap as a dict of splitter name -> view value."""
+    if hmap is None:
+        return None
+    return {name: view.value for name, view in sorted(hmap.items())}
+
 
 class View(object):
-    def __init__(self, value):
+    def __init__(self, value, view_registry):
         self.value = value
         self.parent = None
+        # References: the push of the view, its children, and the ancestor
+        # hypermaps that share it (see Worker.steal)
         self.count = 1
+        view_registry.allocate(self)
+
+    def __deepcopy__(self, memo):
+        return deepcopy_chain(self, memo)
 
     def __str__(self):
         return str(self.value)
@@ -262,9 +425,10 @@ class Stacklet(base.Stacklet):
 
 
 class Frame(base.Frame):
-    def __init__(self, frame_type):
-        super().__init__(frame_type)
+    def __init__(self, frame_type, id_assigner):
+        super().__init__(frame_type, id_assigner)
         self.ancestor_hmap = None
+        self.ancestor_views = []
         self.aug_hmap = None
         self.active_hmap = None
 
@@ -277,5 +441,17 @@ class Frame(base.Frame):
             base_str += "Active map: {}; ".format(self.active_hmap)
         return base_str
 
-
-initial_hmap = {"x": View("init-val"), "y": View("init-val")}
+    def shown_objects(self):
+        """Return the views in the hypermaps of the frame, see __str__."""
+        if self.ancestor_hmap is None:
+            return ()
+        return hmap_views((self.ancestor_hmap, self.aug_hmap.cur_map,
+                           self.active_hmap))
+
+    def get_state(self):
+        state = super().get_state()
+        state["ancestor_hmap"] = hmap_state(self.ancestor_hmap)
+        state["aug_hmap"] = (None if self.aug_hmap is None
+                             else self.aug_hmap.get_state())
+        state["active_hmap"] = hmap_state(self.active_hmap)
+        return state
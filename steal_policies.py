@@ -0,0 +1,126 @@
+#####
+#
+# Victim selection policies for work stealing. A policy picks the victim of
+# `steal (thief id)` actions, for which the caller does not name one, and of
+# the steals of the scheduler. The policy only picks a worker; the RTS checks
+# that the steal is valid, and the steal fails if it is not (e.g. the victim
+# has no stacklet to steal). Each policy counts its steal attempts and
+# failures.
+#
+# random              uniformly random among the other workers
+# round_robin         each thief tries the other workers in turn
+# most_work_first     the worker with the longest deque
+# locality            a neighbour of the thief (by worker id) with probability
+#                     `locality`, otherwise uniformly random
+#
+#####
+
+
+import random
+
+
+class StealPolicy(object):
+    name = None
+
+    def __init__(self):
+        self.num_attempts = 0
+        self.num_failures = 0
+
+    def choose_victim(self, thief, workers):
+        """
+        Return the worker `thief` steals from, out of `workers` (a dict of
+        worker id -> worker), or None if there is no other worker.
+        """
+        raise NotImplementedError
+
+    def get_stats(self):
+        return {
+            "policy": self.name,
+            "attempts": self.num_attempts,
+            "failures": self.num_failures,
+        }
+
+
+def _other_workers(thief, workers):
+    """Return the workers other than `thief`, sorted by id."""
+    return [workers[worker_id] for worker_id in sorted(workers)
+            if worker_id != thief.id]
+
+
+class RandomPolicy(StealPolicy):
+    name = "random"
+
+    def __init__(self, seed=None):
+        super().__init__()
+        self.random = random.Random(seed)
+
+    def choose_victim(self, thief, workers):
+        victims = _other_workers(thief, workers)
+        return self.random.choice(victims) if victims else None
+
+
+class RoundRobinPolicy(StealPolicy):
+    name = "round_robin"
+
+    def __init__(self, seed=None):
+        super().__init__()
+        self.next_offsets = {}  # thief id -> offset of the next victim
+
+    def choose_victim(self, thief, workers):
+        victims = _other_workers(thief, workers)
+        if not victims:
+            return None
+        offset = self.next_offsets.get(thief.id, 0)
+        self.next_offsets[thief.id] = offset + 1
+        # Start after the thief, so that thieves spread over the victims
+        start = sum(1 for victim in victims if victim.id < thief.id)
+        return victims[(start + offset) % len(victims)]
+
+
+class MostWorkFirstPolicy(StealPolicy):
+    name = "most_work_first"
+
+    def __init__(self, seed=None):
+        super().__init__()
+
+    def choose_victim(self, thief, workers):
+        victims = _other_workers(thief, workers)
+        if not victims:
+            return None
+        # Ties go to the lowest worker id
+        return max(victims, key=lambda victim: len(victim.deque))
+
+
+class LocalityPolicy(StealPolicy):
+    name = "locality"
+
+    def __init__(self, seed=None, locality=0.75):
+        super().__init__()
+        self.random = random.Random(seed)
+        self.locality = locality
+
+    def choose_victim(self, thief, workers):
+        victims = _other_workers(thief, workers)
+        if not victims:
+            return None
+        if self.random.random() < self.locality:
+            # Workers are on a ring, ordered by id
+            worker_ids = sorted(workers)
+            i = worker_ids.index(thief.id)
+            neighbour_ids = {worker_ids[(i - 1) % len(worker_ids)],
+                             worker_ids[(i + 1) % len(worker_ids)]}
+            victims = [victim for victim in victims
+                       if victim.id in neighbour_ids]
+        return self.random.choice(victims)
+
+
+STEAL_POLICIES = {
+    policy.name: policy
+    for policy in (RandomPolicy, RoundRobinPolicy, MostWorkFirstPolicy,
+                   LocalityPolicy)
+}
+
+
+def make_policy(name, seed=None):
+    """Return a new policy of the given name, seeded with `seed`."""
+    return STEAL_POLICIES[name](seed)
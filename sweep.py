@@ -0,0 +1,224 @@
+#####
+#
+# Parameter sweep: runs a workload (see workloads.py) with the scheduler for
+# every combination of the given sizes, worker counts, seeds, steal policies
+# and simulator variants, spread over a process pool. Each run builds its own
+# RTS. One row of metrics per run is appended to a CSV file as soon as the run
+# finishes, and runs already in the file are skipped, so an interrupted sweep
+# is resumed by running the same command again. Runs that failed are run
+# again, and their rows replaced. For example
+#
+#   python sweep.py results.csv --workloads fib,quicksort --sizes 15,20 \
+#       --workers 1,2,4,8 --seeds 0-9 --variants base,splitter \
+#       --policies random,most_work_first
+#
+#####
+
+
+import argparse
+import csv
+import itertools
+import multiprocessing
+import os
+import time
+import traceback
+
+from base_runtime_simulator import COUNTER_NAMES
+from scheduler import Scheduler
+from steal_policies import STEAL_POLICIES, make_policy
+from variants import VARIANTS
+from workloads import WORKLOADS, make_program
+
+
+# Columns identifying a run
+KEY_COLUMNS = ("workload", "n", "grain", "variant", "workers", "seed",
+               "policy")
+# Cost counters and view statistics of some variants only, 0 in the others
+COST_COUNTER_NAMES = (
+    "access_hit", "access_miss", "search_hops", "search_probes",
+    "hmaps_merged", "splitters_merged", "views_destroyed_by_merge",
+    "path_copy_nodes", "complex_log_allocs", "root_copy_nodes",
+    "views_allocated", "views_destroyed", "live_views", "max_live_views",
+    "leaked_views", "dangling_views",
+)
+# Attempts and failures of the steal policy, which include the scheduler's
+# failed steals
+POLICY_COLUMNS = ("policy_steal_attempts", "policy_steal_failures")
+METRIC_COLUMNS = (
+    ("status", "error", "wall_time", "num_actions", "num_steps",
+     "num_steal_attempts", "num_failed_steals", "max_deque_depth") +
+    COUNTER_NAMES + COST_COUNTER_NAMES + POLICY_COLUMNS
+)
+COLUMNS = KEY_COLUMNS + METRIC_COLUMNS
+
+
+def run_config(config):
+    """
+    Run one configuration, a dict with the KEY_COLUMNS. Return the row of
+    results, with status "error" and the exception if the run failed.
+    """
+    row = dict(config)
+    row.update({column: 0 for column in METRIC_COLUMNS})
+    row["error"] = ""
+    module = VARIANTS[config["variant"]]
+    try:
+        start = time.perf_counter()
+        program = make_program(config["workload"], config["n"],
+                               config["variant"], config["grain"],
+                               config["seed"])
+        rts = module.RTS(config["workers"])
+        scheduler = Scheduler(program, rts, config["seed"],
+                              module.parse_action,
+                              make_policy(config["policy"], config["seed"]))
+        trace = scheduler.run()
+        row["wall_time"] = time.perf_counter() - start
+        row["num_actions"] = len(trace)
+        row["num_steps"] = scheduler.num_steps
+        row["num_steal_attempts"] = scheduler.num_steal_attempts
+        row["num_failed_steals"] = scheduler.num_failed_steals
+        stats = rts.get_stats()
+        for column in METRIC_COLUMNS:
+            if column in stats["total"]:
+                row[column] = stats["total"][column]
+        row["policy_steal_attempts"] = stats["steal_policy"]["attempts"]
+        row["policy_steal_failures"] = stats["steal_policy"]["failures"]
+        row["status"] = "ok"
+    except Exception:
+        row["status"] = "error"
+        row["error"] = traceback.format_exc(limit=1).strip().splitlines()[-1]
+    return row
+
+
+def _key(row):
+    # Same as written by csv, which writes None as an empty string
+    return tuple("" if row[column] is None else str(row[column])
+                 for column in KEY_COLUMNS)
+
+
+def read_results(path):
+    """
+    Return the rows of the results file at `path` by key, the last row of
+    each key if there are several.
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", newline="") as f:
+        return {_key(row): row for row in csv.DictReader(f)}
+
+
+def completed_keys(path):
+    """Return the keys of the successful runs in the results file `path`."""
+    return {
+        key for key, row in read_results(path).items()
+        if row["status"] == "ok"
+    }
+
+
+def _drop_rows(path, keys):
+    """Rewrite the results file at `path` without the rows of `keys`."""
+    with open(path, "r", newline="") as f:
+        rows = [row for row in csv.DictReader(f) if _key(row) not in keys]
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(tmp_path, path)
+
+
+def make_configs(workloads, sizes, workers, seeds, policies, variants,
+                 grain=None):
+    """Return the configurations of a sweep, one dict per run."""
+    return [
+        dict(zip(KEY_COLUMNS, (workload, n, grain, variant, num_workers,
+                               seed, policy)))
+        for workload, n, variant, num_workers, seed, policy in
+        itertools.product(workloads, sizes, variants, workers, seeds,
+                          policies)
+    ]
+
+
+def run_sweep(configs, path, processes=None):
+    """
+    Run the configurations not yet in the results file at `path`, or that
+    failed, on a pool of `processes` processes, appending a row per run as it
+    finishes. The rows of the failed runs that are run again are removed
+    first. Return the number of runs performed.
+    """
+    results = read_results(path)
+    done = {key for key, row in results.items() if row["status"] == "ok"}
+    to_run = [config for config in configs if _key(config) not in done]
+    failed = {_key(config) for config in to_run} & set(results)
+    if failed:
+        _drop_rows(path, failed)
+    write_header = not os.path.exists(path) or os.path.getsize(path) == 0
+    with open(path, "a", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS)
+        if write_header:
+            writer.writeheader()
+        with multiprocessing.Pool(processes) as pool:
+            for i, row in enumerate(pool.imap_unordered(run_config, to_run)):
+                writer.writerow(row)
+                f.flush()
+                print("[{}/{}] {}".format(
+                    i + 1, len(to_run),
+                    " ".join("{}={}".format(column, row[column])
+                             for column in KEY_COLUMNS + ("status",))))
+    return len(to_run)
+
+
+def _int_list(s):
+    """Parse e.g. "1,2,8-10" to [1, 2, 8, 9, 10]."""
+    values = []
+    for part in s.split(","):
+        if "-" in part:
+            lo, hi = part.split("-")
+            values.extend(range(int(lo), int(hi) + 1))
+        else:
+            values.append(int(part))
+    return values
+
+
+def _choice_list(choices):
+    def parse(s):
+        values = s.split(",")
+        for value in values:
+            if value not in choices:
+                raise argparse.ArgumentTypeError(
+                    "invalid choice: {} (choose from {})".format(
+                        value, ", ".join(choices)))
+        return values
+    return parse
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("results", help="CSV file the results are added to")
+    parser.add_argument("--workloads", type=_choice_list(sorted(WORKLOADS)),
+                        default=["fib"])
+    parser.add_argument("--sizes", type=_int_list, default=[10])
+    parser.add_argument("--grain", type=int,
+                        help="base case size (quicksort, matmul, cilk_for)")
+    parser.add_argument("--workers", type=_int_list, default=[4])
+    parser.add_argument("--seeds", type=_int_list, default=[0])
+    parser.add_argument("--policies",
+                        type=_choice_list(list(STEAL_POLICIES)),
+                        default=["random"],
+                        help="steal policies: {}".format(
+                            ", ".join(STEAL_POLICIES)))
+    parser.add_argument("--variants", type=_choice_list(list(VARIANTS)),
+                        default=list(VARIANTS))
+    parser.add_argument("--processes", type=int,
+                        help="size of the process pool, number of CPUs by "
+                             "default")
+    args = parser.parse_args()
+    configs = make_configs(args.workloads, args.sizes, args.workers,
+                           args.seeds, args.policies, args.variants,
+                           args.grain)
+    num_runs = run_sweep(configs, args.results, args.processes)
+    print("{} runs performed, {} already in {}".format(
+        num_runs, len(configs) - num_runs, args.results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+#####
+#
+# Discrete-event timing model: runs a program with the scheduler (see
+# scheduler.py), but with workers that proceed concurrently on a shared clock
+# instead of in rounds. A heap of events holds the time at which each worker
+# is next free. The free worker with the earliest time performs its next step,
+# which takes effect immediately and keeps the worker busy for the cost of the
+# step. For example
+#
+#   python timing_model.py fib 15 --workers 8 --variant splitter \
+#       --cost random_steal_success=200 --cost search_hops=5
+#
+# The cost of a step is the cost of the events the step counts on the worker
+# (see COUNTER_NAMES and the counters of the variants), plus `work` per unit
+# of ("work", n) instructions. So spawn overhead is the cost of "spawn", steal
+# latency that of "random_steal_success" and "random_steal_fail", splitter
+# accesses cost per "search_hops", "search_probes" or "path_copy_nodes", and
+# hypermap merges per "hmaps_merged", "splitters_merged" and
+# "views_destroyed_by_merge".
+#
+# The run reports the makespan, the utilization (the fraction of worker time
+# spent on work and actions other than steals) and the time spent stealing.
+#
+#####
+
+
+import argparse
+import heapq
+from collections import Counter
+
+import base_runtime_simulator as base
+from scheduler import Scheduler
+from steal_policies import STEAL_POLICIES, make_policy
+from variants import VARIANTS
+from workloads import WORKLOADS, make_program
+
+
+# Time units per event, and per unit of work. Events that are not listed
+# cost nothing. Costs can not be negative.
+DEFAULT_COSTS = {
+    "work": 1,
+    "spawn": 10,
+    "call": 2,
+    "return": 2,
+    "sync_noop": 1,
+    "sync_suspend": 10,
+    "random_steal_success": 100,
+    "random_steal_fail": 50,
+    "provably_good_steal_success": 20,
+    "unconditional_steal_success": 20,
+    "splitter_push": 2,
+    "splitter_set": 1,
+    "splitter_pop": 2,
+    "splitter_access": 1,
+    "splitter_write": 1,
+    "search_hops": 2,
+    "search_probes": 1,
+    "path_copy_nodes": 3,
+    "root_copy_nodes": 3,
+    "complex_log_allocs": 5,
+    "hmaps_merged": 10,
+    "splitters_merged": 2,
+    "views_destroyed_by_merge": 1,
+}
+
+
+# Minimum time a step keeps a worker busy, whatever its cost
+MIN_STEP_TIME = 1
+
+
+class CostModel(object):
+    """Costs of events and work, DEFAULT_COSTS updated with `costs`."""
+    def __init__(self, costs=None):
+        self.costs = dict(DEFAULT_COSTS)
+        if costs is not None:
+            self.costs.update(costs)
+        for name, cost in self.costs.items():
+            if cost < 0:
+                raise ValueError("Cost of {} is negative: {}".format(name,
+                                                                     cost))
+
+    def step_cost(self, events, work):
+        """
+        Return the cost of a step that counted `events` (a Counter) and did
+        `work` units of work.
+        """
+        cost = work * self.costs["work"]
+        for name, count in events.items():
+            cost += count * self.costs.get(name, 0)
+        return cost
+
+
+class TimedScheduler(Scheduler):
+    """Scheduler whose workers proceed on a shared clock, see above."""
+    def __init__(self, program, rts, seed=None,
+                 parse_action=base.parse_action, steal_policy=None,
+                 cost_model=None):
+        super().__init__(program, rts, seed, parse_action, steal_policy)
+        self.cost_model = CostModel() if cost_model is None else cost_model
+        self.clock = 0
+        self.step_work = 0  # work of the current step
+        # Per worker id
+        self.work_time = Counter()  # on ("work", n) instructions
+        self.action_time = Counter()  # on actions other than steals
+        self.steal_time = Counter()  # on steal attempts
+
+    def work(self, worker, amount):
+        self.step_work += amount
+
+    def timed_step(self, worker):
+        """Perform a step of `worker`, return its cost."""
+        events_before = Counter(worker.counters)
+        self.step_work = 0
+        stealing = worker.deque.is_empty()
+        if stealing:
+            self.try_steal(worker)
+        else:
+            self.step(worker)
+        events = Counter(worker.counters)
+        events.subtract(events_before)
+        cost = self.cost_model.step_cost(events, self.step_work)
+        work_cost = self.step_work * self.cost_model.costs["work"]
+        if stealing:
+            self.steal_time[worker.id] += cost
+        else:
+            self.work_time[worker.id] += work_cost
+            self.action_time[worker.id] += cost - work_cost
+        return cost
+
+    def run(self):
+        """Run the program to completion, return the trace of actions."""
+        workers = list(self.rts.workers.values())
+        self.random.shuffle(workers)
+        # (time the worker is free, order of insertion, worker)
+        events = [(0, i, worker) for i, worker in enumerate(workers)]
+        heapq.heapify(events)
+        num_events = len(events)
+        while not self.done:
+            if all(worker.deque.is_empty() for worker in workers):
+                raise RuntimeError("No worker has work, but the program has "
+                                   "not completed.")
+            self.clock, _, worker = heapq.heappop(events)
+            self.num_steps += 1
+            # Steps take at least MIN_STEP_TIME, even if they cost nothing,
+            # so that idle workers do not steal forever at the same time
+            step_time = max(self.timed_step(worker), MIN_STEP_TIME)
+            if self.done:
+                self.clock += step_time
+                break
+            heapq.heappush(events, (self.clock + step_time, num_events,
+                                    worker))
+            num_events += 1
+        return self.trace
+
+    def get_report(self):
+        """
+        Return the makespan, utilization and time spent stealing of the run,
+        and the time of each worker by category, as a dict.
+        """
+        num_workers = len(self.rts.workers)
+        busy_time = sum(self.work_time.values()) + sum(
+            self.action_time.values())
+        capacity = self.clock * num_workers
+        return {
+            "makespan": self.clock,
+            "utilization": busy_time / capacity if capacity else 1.0,
+            "work_time": sum(self.work_time.values()),
+            "action_time": sum(self.action_time.values()),
+            "steal_time": sum(self.steal_time.values()),
+            "workers": {
+                worker_id: {
+                    "work_time": self.work_time[worker_id],
+                    "action_time": self.action_time[worker_id],
+                    "steal_time": self.steal_time[worker_id],
+                }
+                for worker_id in sorted(self.rts.workers)
+            },
+        }
+
+
+def format_report(report):
+    str_comp = [
+        "makespan:    {}\n".format(report["makespan"]),
+        "utilization: {:.1%}\n".format(report["utilization"]),
+        "work time:   {}\n".format(report["work_time"]),
+        "action time: {}\n".format(report["action_time"]),
+        "steal time:  {}\n".format(report["steal_time"]),
+        "\nworker  work  actions  stealing\n",
+    ]
+    for worker_id, times in report["workers"].items():
+        str_comp.append("{:<6}  {:>4}  {:>7}  {:>8}\n".format(
+            worker_id, times["work_time"], times["action_time"],
+            times["steal_time"]))
+    return "".join(str_comp)
+
+
+def _cost(s):
+    """Parse e.g. "spawn=20" to ("spawn", 20)."""
+    try:
+        name, value = s.split("=")
+        value = float(value) if "." in value else int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "invalid cost: {} (expected name=value)".format(s))
+    if value < 0:
+        raise argparse.ArgumentTypeError(
+            "invalid cost: {} (costs can not be negative)".format(s))
+    return name, value
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("workload", choices=sorted(WORKLOADS))
+    parser.add_argument("n", type=int, help="problem size")
+    parser.add_argument("--grain", type=int,
+                        help="base case size (quicksort, matmul, cilk_for)")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--variant", choices=sorted(VARIANTS), default="base")
+    parser.add_argument("--policy", choices=list(STEAL_POLICIES),
+                        default="random")
+    parser.add_argument("--cost", type=_cost, action="append", default=[],
+                        metavar="NAME=VALUE",
+                        help="cost of an event, or of a unit of work; can be "
+                             "repeated")
+    args = parser.parse_args()
+    module = VARIANTS[args.variant]
+    program = make_program(args.workload, args.n, args.variant, args.grain,
+                           args.seed)
+    scheduler = TimedScheduler(program, module.RTS(args.workers), args.seed,
+                               module.parse_action,
+                               make_policy(args.policy, args.seed),
+                               CostModel(dict(args.cost)))
+    scheduler.run()
+    print(format_report(scheduler.get_report()), end="")
+
+
+if __name__ == "__main__":
+    main()
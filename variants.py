@@ -0,0 +1,29 @@
+#####
+#
+# The runtime system simulator variants, by name. Each variant is a module, or
+# a namespace, that provides an RTS class and a parse_action function.
+#
+# search_based_indexed is the search-based simulator with indexed splitter
+# lookups, to compare the cost of both searches.
+#
+#####
+
+
+from types import SimpleNamespace
+
+import base_runtime_simulator
+import splitter_runtime_simulator
+import search_based_splitter_runtime_simulator
+import log_splitter_runtime_simulator
+
+
+VARIANTS = {
+    "base": base_runtime_simulator,
+    "splitter": splitter_runtime_simulator,
+    "search_based": search_based_splitter_runtime_simulator,
+    "search_based_indexed": SimpleNamespace(
+        RTS=search_based_splitter_runtime_simulator.IndexedRTS,
+        parse_action=search_based_splitter_runtime_simulator.parse_action,
+    ),
+    "log_splitter": log_splitter_runtime_simulator,
+}
@@ -0,0 +1,209 @@
+#####
+#
+# Parametrized Cilk programs, as tasks for the scheduler (see scheduler.py),
+# and a command line tool to write their action traces. For example
+#
+#   python workloads.py fib 20 --workers 8 --variant splitter > fib20.txt
+#
+# writes the trace of fib(20) run by 8 workers on the splitter simulator,
+# which can then be fed to main.py.
+#
+# Base cases do an amount of work (see scheduler.py) that is proportional to
+# their size, for the timing model.
+#
+# Splitter operations are added according to the simulator variant:
+#
+# splitter, search_based, search_based_indexed:
+#     each task pushes a splitter and sets its value on entry, and pops it
+#     before returning
+# log_splitter:
+#     each leaf task spawns a child that accesses a splitter and writes it
+#
+#####
+
+
+import argparse
+import sys
+
+from scheduler import Scheduler
+from variants import VARIANTS
+
+
+class SplitterOps(object):
+    """Splitter instructions added to tasks; none by default."""
+    def enter(self, value):
+        return []
+
+    def leave(self):
+        return []
+
+    def leaf(self, value):
+        return []
+
+
+class StackSplitterOps(SplitterOps):
+    """Push/set/pop of a splitter around every task."""
+    def __init__(self, splitter_name="x"):
+        self.splitter_name = splitter_name
+
+    def enter(self, value):
+        return [("push", self.splitter_name),
+                ("set", self.splitter_name, value)]
+
+    def leave(self):
+        return [("pop", self.splitter_name)]
+
+
+class LogSplitterOps(SplitterOps):
+    """
+    Access/write of a splitter in a child spawned by each leaf task. A
+    spawned frame without children is never stolen from, which the log
+    splitter simulator needs to undo the write when the frame returns.
+    """
+    def __init__(self, splitter_name="W"):
+        self.splitter_name = splitter_name
+
+    def leaf(self, value):
+        write_task = [("access", self.splitter_name),
+                      ("write", self.splitter_name, value)]
+        return [("spawn", write_task), ("sync",)]
+
+
+SPLITTER_OPS = {
+    "base": SplitterOps(),
+    "splitter": StackSplitterOps(),
+    "search_based": StackSplitterOps(),
+    "search_based_indexed": StackSplitterOps(),
+    "log_splitter": LogSplitterOps(),
+}
+
+
+def fib(n, ops=SplitterOps()):
+    """fib(n) = spawn fib(n - 1); call fib(n - 2); sync."""
+    value = "fib{}".format(n)
+    yield from ops.enter(value)
+    if n < 2:
+        yield ("work", 1)
+        yield from ops.leaf(value)
+    else:
+        yield ("spawn", fib(n - 1, ops))
+        yield ("call", fib(n - 2, ops))
+        yield ("sync",)
+    yield from ops.leave()
+
+
+def quicksort(n, grain=1, seed=0, ops=SplitterOps(), lo=0):
+    """
+    Divide-and-conquer quicksort of n elements: partition, then spawn the
+    sort of one part and call the sort of the other. The pivot position is
+    pseudo-random, determined by seed and the range sorted.
+    """
+    value = "qs{}-{}".format(lo, lo + n)
+    yield from ops.enter(value)
+    if n <= grain:
+        yield ("work", max(n, 1))
+        yield from ops.leaf(value)
+    else:
+        pivot = (lo * 7919 + n * 104729 + seed * 1299709) % n
+        yield ("spawn", quicksort(pivot, grain, seed, ops, lo))
+        yield ("call", quicksort(n - pivot - 1, grain, seed, ops,
+                                 lo + pivot + 1))
+        yield ("sync",)
+    yield from ops.leave()
+
+
+def matmul(n, base=1, ops=SplitterOps()):
+    """
+    Recursive n x n matrix multiplication: eight n/2 x n/2 multiplications,
+    in two rounds of four parallel ones.
+    """
+    value = "mm{}".format(n)
+    yield from ops.enter(value)
+    if n <= base:
+        yield ("work", max(n, 1) ** 3)
+        yield from ops.leaf(value)
+    else:
+        for _ in range(2):
+            for _ in range(3):
+                yield ("spawn", matmul(n // 2, base, ops))
+            yield ("call", matmul(n // 2, base, ops))
+            yield ("sync",)
+    yield from ops.leave()
+
+
+def cilk_for(n, grain=1, ops=SplitterOps(), lo=0):
+    """
+    cilk_for loop over n iterations, split in halves down to grain iterations.
+    Each iteration calls the loop body.
+    """
+    value = "for{}-{}".format(lo, lo + n)
+    yield from ops.enter(value)
+    if n <= grain:
+        for i in range(lo, lo + n):
+            yield ("call", _loop_body(i, ops))
+    else:
+        half = n // 2
+        yield ("spawn", cilk_for(half, grain, ops, lo))
+        yield ("call", cilk_for(n - half, grain, ops, lo + half))
+        yield ("sync",)
+    yield from ops.leave()
+
+
+def _loop_body(i, ops):
+    value = "iter{}".format(i)
+    yield from ops.enter(value)
+    yield ("work", 1)
+    yield from ops.leaf(value)
+    yield from ops.leave()
+
+
+WORKLOADS = {
+    "fib": fib,
+    "quicksort": quicksort,
+    "matmul": matmul,
+    "cilk_for": cilk_for,
+}
+
+
+def make_program(workload, n, variant="base", grain=None, seed=0):
+    """Return the root task of a workload, with the variant's splitter ops."""
+    ops = SPLITTER_OPS[variant]
+    if workload == "fib":
+        return fib(n, ops)
+    elif workload == "quicksort":
+        return quicksort(n, grain or 1, seed, ops)
+    elif workload == "matmul":
+        return matmul(n, grain or 1, ops)
+    elif workload == "cilk_for":
+        return cilk_for(n, grain or 1, ops)
+    raise ValueError("Unknown workload {}".format(workload))
+
+
+def generate_trace(workload, n, variant="base", num_workers=4, grain=None,
+                   seed=0):
+    """Run a workload with the scheduler, return its trace of actions."""
+    module = VARIANTS[variant]
+    program = make_program(workload, n, variant, grain, seed)
+    scheduler = Scheduler(program, module.RTS(num_workers), seed,
+                          module.parse_action)
+    return scheduler.run()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("workload", choices=sorted(WORKLOADS))
+    parser.add_argument("n", type=int, help="problem size")
+    parser.add_argument("--grain", type=int,
+                        help="base case size (quicksort, matmul, cilk_for)")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--variant", choices=sorted(VARIANTS), default="base")
+    args = parser.parse_args()
+    trace = generate_trace(args.workload, args.n, args.variant, args.workers,
+                           args.grain, args.seed)
+    for line in trace:
+        sys.stdout.write(line + "\n")
+
+
+if __name__ == "__main__":
+    main()